@@ -0,0 +1,68 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script computes drug co-occurrence across trials, their Jaccard overlap and
+## the targets shared by drug pairs with sparse matrix products over the incidence
+## matrices of a CTIndex (trial x drug, drug x gene and trial x condition, see ct_index.py)
+## results are sparse drug x drug (or condition x drug) matrices coded like the
+## index vocabularies; only the non zero pairs are ever stored
+## Usage: from ct_cooccurrence import *
+##        index = CTIndex.from_dataset(CTDataset())
+##        top_pairs(drug_jaccard(index), index.drugs, n=20)
+"""
+
+# import packages
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# (cols x cols) counts of the rows shared by every pair of columns of a boolean
+# incidence matrix, e.g. trials shared by two drugs for a trial x drug matrix
+# the diagonal holds the number of rows of every column
+def cooccurrence(incidence):
+    x = incidence.astype(np.int32).tocsc()
+    return (x.T @ x).tocsr()
+
+# Jaccard overlap |A & B| / |A | B| of the rows of every pair of columns
+# computed on the non zero co-occurrences only
+def jaccard(incidence):
+    co = cooccurrence(incidence).tocoo()
+    sizes = np.asarray(incidence.sum(axis=0)).ravel()
+    union = sizes[co.row] + sizes[co.col] - co.data
+    return sp.csr_matrix((co.data / union, (co.row, co.col)), shape=co.shape)
+
+### drug analytics of a CTIndex
+
+# number of trials testing both drugs of every pair
+def drug_cooccurrence(index):
+    return cooccurrence(index.trial_drug)
+
+# Jaccard overlap of the trials of every pair of drugs
+def drug_jaccard(index):
+    return jaccard(index.trial_drug)
+
+# number of targets shared by every pair of drugs
+def drug_shared_targets(index):
+    return cooccurrence(index.drug_gene.T.tocsr())
+
+# Jaccard overlap of the targets of every pair of drugs
+def drug_target_jaccard(index):
+    return jaccard(index.drug_gene.T.tocsr())
+
+# number of trials of every (condition, drug) pair
+def condition_drug_counts(index):
+    return (index.trial_condition.T.astype(np.int32) @ index.trial_drug.astype(np.int32)).tocsr()
+
+# the pairs of a square pair matrix as a frame, each pair once and without the
+# diagonal, sorted by value; n keeps only the top n pairs, min_value drops the smaller ones
+def top_pairs(matrix, vocab, n=None, min_value=None):
+    upper = sp.triu(matrix, k=1).tocoo()
+    keep = upper.data > 0 if min_value is None else upper.data >= min_value
+    pairs = pd.DataFrame({'name_1':vocab[upper.row[keep]], 'name_2':vocab[upper.col[keep]],
+                          'value':upper.data[keep]})
+    pairs = pairs.sort_values('value', ascending=False, kind='mergesort').reset_index(drop=True)
+    return pairs if n is None else pairs.head(n)
+
+# value of one pair of names in a pair matrix
+def pair_value(matrix, vocab_1, vocab_2, name_1, name_2):
+    return matrix[vocab_1.get_loc(name_1), vocab_2.get_loc(name_2)]
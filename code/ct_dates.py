@@ -0,0 +1,58 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script normalizes the trial start dates, given by clinicaltrials.gov as
+## "Month YYYY" or "Month DD, YYYY", into typed columns
+## start_month (1-12), start_year and start_datetime (the first of the month when
+## there is no day); dates in other formats are left missing
+## Usage: from ct_dates import parse_start_dates, add_start_dates
+"""
+
+# import packages
+import pandas as pd
+
+START_DATE_COLUMNS = ['start_month', 'start_year', 'start_datetime']
+
+# month names and their abbreviations, lower case
+MONTHS = {}
+for i, name in enumerate(['january', 'february', 'march', 'april', 'may', 'june', 'july',
+                          'august', 'september', 'october', 'november', 'december'], 1):
+    MONTHS[name] = i
+    MONTHS[name[:3]] = i
+
+DATE_PATTERN = r'^\s*(?P<month>[A-Za-z]+)\.?\s+(?:(?P<day>\d{1,2}),\s*)?(?P<year>\d{4})\s*$'
+
+# start_month, start_year and start_datetime of a series of date strings
+# every string is matched once by a single regular expression
+def parse_start_dates(dates):
+    parts = dates.astype('string').str.extract(DATE_PATTERN)
+
+    month = parts.month.str.lower().map(MONTHS).astype('Int64')
+    year = pd.to_numeric(parts.year).astype('Int64')
+    # dates with an unknown month are not parsed
+    year[month.isna()] = pd.NA
+    day = pd.to_numeric(parts.day).astype('Int64').fillna(1)
+
+    # invalid days (e.g. February 30) give a missing datetime
+    parsed = year.notna()
+    start_datetime = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    start_datetime[parsed.to_numpy()] = pd.to_datetime(pd.DataFrame({'year':year, 'month':month, 'day':day})[parsed].astype(int),
+                                                       errors='coerce')
+
+    return pd.DataFrame({'start_month':month, 'start_year':year, 'start_datetime':start_datetime})
+
+# the trials with the typed start date columns
+# columns that are already there (e.g. read back from a csv file) only get their
+# types restored; otherwise they are parsed from start_date
+def add_start_dates(df):
+    df = df.copy()
+    if all(c in df.columns for c in START_DATE_COLUMNS):
+        df['start_month'] = pd.to_numeric(df.start_month).astype('Int64')
+        df['start_year'] = pd.to_numeric(df.start_year).astype('Int64')
+        df['start_datetime'] = pd.to_datetime(df.start_datetime)
+        return df
+
+    dates = parse_start_dates(df.start_date)
+    for c in START_DATE_COLUMNS:
+        df[c] = dates[c]
+    return df
@@ -0,0 +1,137 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script precomputes inverted indexes between trials, drugs, target genes
+## and conditions
+## trials, drugs, genes and conditions are coded as integers (their position in
+## the trials, drugs, genes and conditions vocabularies) and every index is a
+## boolean scipy.sparse csr matrix: row i of gene_drugs holds the drugs targeting
+## gene i, so a lookup is a slice of the matrix and set operations and counts
+## over many keys are sparse matrix operations
+## Usage: from ct_index import CTIndex
+##        index = CTIndex.from_dataset(CTDataset())
+##        index.trials_of_genes(['EGFR'])
+"""
+
+# import packages
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# the names of the ';' separated conditions of each trial, one row per condition
+def split_conditions(df):
+    conditions = df[['nct_id','conditions']].dropna()
+    conditions = conditions.assign(condition=conditions.conditions.str.split(';')).explode('condition')
+    conditions['condition'] = conditions.condition.str.strip()
+    return conditions[conditions.condition != ''][['nct_id','condition']].drop_duplicates()
+
+# boolean (rows x cols) matrix with a 1 for every (row, col) pair of names
+# names missing from a vocabulary are dropped
+def incidence_matrix(row_names, col_names, row_vocab, col_vocab):
+    rows = row_vocab.get_indexer(row_names)
+    cols = col_vocab.get_indexer(col_names)
+    known = (rows >= 0) & (cols >= 0)
+    data = np.ones(known.sum(), dtype=bool)
+    matrix = sp.csr_matrix((data, (rows[known], cols[known])), shape=(len(row_vocab), len(col_vocab)))
+    # duplicate pairs are summed by scipy; keep them as a single True
+    matrix.sum_duplicates()
+    return matrix
+
+class CTIndex:
+
+    VOCABULARIES = ['trials', 'drugs', 'genes', 'conditions']
+    MATRICES = ['trial_drug', 'drug_gene', 'trial_condition']
+
+    # vocabularies are pd.Index objects; the matrices are the trial x drug,
+    # drug x gene and trial x condition incidences the indexes are built from
+    def __init__(self, trials, drugs, genes, conditions, trial_drug, drug_gene, trial_condition):
+        self.trials = trials
+        self.drugs = drugs
+        self.genes = genes
+        self.conditions = conditions
+        self.trial_drug = trial_drug.tocsr()
+        self.drug_gene = drug_gene.tocsr()
+        self.trial_condition = trial_condition.tocsr()
+
+        ### inverted indexes
+        self.gene_drugs = self.drug_gene.T.tocsr()
+        self.drug_trials = self.trial_drug.T.tocsr()
+        self.trial_genes = (self.trial_drug.astype(np.int32) @ self.drug_gene.astype(np.int32)).astype(bool).tocsr()
+        self.condition_trials = self.trial_condition.T.tocsr()
+        self.gene_trials = self.trial_genes.T.tocsr()
+
+    # drug_df: trials mapped to drugs (nct_id, intervention), db_target_df: drugbank
+    # drugs and their targets (Name, Gene_Target), df: the trials (nct_id, conditions)
+    @classmethod
+    def from_tables(cls, drug_df, db_target_df, df):
+        targets = db_target_df[['Name','Gene_Target']].dropna().drop_duplicates()
+        conditions = split_conditions(df)
+
+        trials = pd.Index(sorted(set(df.nct_id.dropna())))
+        drugs = pd.Index(sorted(set(drug_df.intervention.dropna()) | set(targets.Name)))
+        genes = pd.Index(sorted(set(targets.Gene_Target)))
+        conditions_vocab = pd.Index(sorted(set(conditions.condition)))
+
+        return cls(trials, drugs, genes, conditions_vocab,
+                   incidence_matrix(drug_df.nct_id, drug_df.intervention, trials, drugs),
+                   incidence_matrix(targets.Name, targets.Gene_Target, drugs, genes),
+                   incidence_matrix(conditions.nct_id, conditions.condition, trials, conditions_vocab))
+
+    # built from the tables of a read_data.CTDataset
+    @classmethod
+    def from_dataset(cls, data):
+        return cls.from_tables(data.drug_df, data.db_target_df, data.df)
+
+    # the vocabularies are saved as .npy files and the matrices as .npz files
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in self.VOCABULARIES:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name).to_numpy(dtype=str))
+        for name in self.MATRICES:
+            sp.save_npz(os.path.join(path, name + '.npz'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path):
+        vocabs = [pd.Index(np.load(os.path.join(path, name + '.npy')).astype(object)) for name in cls.VOCABULARIES]
+        matrices = [sp.load_npz(os.path.join(path, name + '.npz')) for name in cls.MATRICES]
+        return cls(*vocabs, *matrices)
+
+    ### lookups
+
+    # codes of the names in a vocabulary (names that are not in it are dropped)
+    @staticmethod
+    def codes(vocab, names):
+        codes = vocab.get_indexer(list(names))
+        return codes[codes >= 0]
+
+    # names of the columns of an index matrix that hold for any of the row names
+    # (the union of the rows; with count=True the number of rows each column holds for)
+    def _lookup(self, matrix, row_vocab, col_vocab, names, count=False):
+        rows = matrix[self.codes(row_vocab, names)]
+        if count:
+            counts = np.asarray(rows.sum(axis=0)).ravel()
+            hits = np.flatnonzero(counts)
+            return pd.Series(counts[hits], index=col_vocab[hits])
+        return list(col_vocab[np.unique(rows.indices)])
+
+    def drugs_of_genes(self, genes, count=False):
+        return self._lookup(self.gene_drugs, self.genes, self.drugs, genes, count)
+
+    def trials_of_drugs(self, drugs, count=False):
+        return self._lookup(self.drug_trials, self.drugs, self.trials, drugs, count)
+
+    def genes_of_trials(self, trials, count=False):
+        return self._lookup(self.trial_genes, self.trials, self.genes, trials, count)
+
+    def trials_of_conditions(self, conditions, count=False):
+        return self._lookup(self.condition_trials, self.conditions, self.trials, conditions, count)
+
+    # trials testing a drug that targets any of the genes
+    def trials_of_genes(self, genes, count=False):
+        return self._lookup(self.gene_trials, self.genes, self.trials, genes, count)
+
+    # number of entries of every key of an index, e.g. counts(index.gene_drugs, index.genes)
+    @staticmethod
+    def counts(matrix, vocab):
+        return pd.Series(np.diff(matrix.indptr), index=vocab)
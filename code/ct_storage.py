@@ -0,0 +1,98 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script reads and writes the tables produced by the pipeline
+## tables are stored as csv (default) or as columnar parquet files
+## set CT_STORAGE_FORMAT=parquet to switch every writer and reader to parquet
+## Usage: from ct_storage import read_table, write_table, TableWriter
+"""
+
+# import packages
+import os
+import pandas as pd
+
+# settings
+# 'csv' or 'parquet'
+STORAGE_FORMAT = os.environ.get("CT_STORAGE_FORMAT", "csv")
+
+# low cardinality columns stored as categoricals in parquet
+CATEGORICAL_COLUMNS = ['phase', 'status', 'study_type', 'intervention_type']
+
+# path of a table in the given format -- paths are written with the .csv extension
+def table_path(path, fmt=STORAGE_FORMAT):
+    root, ext = os.path.splitext(path)
+    if fmt == 'parquet':
+        return root + '.parquet'
+    return path
+
+# convert the categorical columns of a frame before it is written to parquet
+def to_categoricals(df):
+    df = df.copy()
+    for c in CATEGORICAL_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df
+
+# read a table, optionally only the given columns
+# extra keyword arguments are passed on to pd.read_csv
+def read_table(path, columns=None, fmt=STORAGE_FORMAT, **csv_kwargs):
+    if fmt == 'parquet':
+        return pd.read_parquet(table_path(path, fmt), columns=columns)
+    return pd.read_csv(path, usecols=columns, **csv_kwargs)
+
+# write a table; the index is only kept in csv files
+def write_table(df, path, fmt=STORAGE_FORMAT, index=False):
+    if fmt == 'parquet':
+        to_categoricals(df).to_parquet(table_path(path, fmt), index=False)
+    else:
+        df.to_csv(path, index=index)
+
+# write a table chunk by chunk
+# parquet chunks become row groups of one file; the schema of the first chunk
+# is kept so columns that are empty in later chunks do not change type
+class TableWriter:
+
+    def __init__(self, path, fmt=STORAGE_FORMAT, index=False):
+        self.path = table_path(path, fmt)
+        self.fmt = fmt
+        self.index = index
+        self.n_chunks = 0
+        self._writer = None
+
+    def write(self, df):
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self._writer is None:
+                fields = []
+                for c in df.columns:
+                    if c in CATEGORICAL_COLUMNS:
+                        fields.append(pa.field(c, pa.dictionary(pa.int32(), pa.string())))
+                    elif df[c].dtype == object:
+                        fields.append(pa.field(c, pa.string()))
+                    else:
+                        fields.append(pa.field(c, pa.Schema.from_pandas(df[[c]], preserve_index=False).field(c).type))
+                # the pandas metadata restores the column types (e.g. nullable integers) on read
+                self.schema = pa.schema(fields, metadata=pa.Schema.from_pandas(df, preserve_index=False).metadata)
+                self._writer = pq.ParquetWriter(self.path, self.schema)
+
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            if self.n_chunks == 0:
+                df.to_csv(self.path, index=self.index)
+            else:
+                df.to_csv(self.path, index=self.index, mode='a', header=False)
+        self.n_chunks += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -31,10 +31,12 @@ Input files : __ save the following files in the ../data/raw folder
 
     1.5) fuzzy string match of the names with the drugbank names
 
-    1.6) save this data `../data/out/drug_mapped_ct_data.csv`
+    1.6) save this data `../data/out/drug_mapped_ct_data.csv` (with the step that mapped each row in `mapping_step`)
 
 2. find the drugs used as placebo -- file saved: `../data/out/placebo_trials.csv`
 
+the pipeline tables are read and written as parquet instead of csv with CT_STORAGE_FORMAT=parquet (see ct_storage.py)
+
 """
 
 # import files
@@ -47,44 +49,47 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import time
 import copy
+import os
+import json
+from ct_storage import read_table, write_table, table_path
+from drug_matching import match_drug_names, map_synonyms, contains_pairs, fuzzy_matches, PlaceboClassifier, PLACEBO_RULES_FILE, MATCHING_VERSION
+from drug_dictionary import DrugDictionary, DICTIONARY_VERSION
+from mapping_cache import MappingCache
 
 import warnings
 warnings.filterwarnings('ignore')
 
-###
-## Step 1: Map drug interventions to Drug Bank (Direct Matching)
-###
-
-drug_df = pd.read_csv("../data/raw/intervention_ct_data.csv")
-print("N trials:", drug_df.nct_id.nunique())
-print("N interventions", drug_df.intervention.nunique())
-print(drug_df.head())
+# settings
+# number of worker processes used for the fuzzy matching (1 = serial)
+N_WORKERS = int(os.environ.get("CT_N_WORKERS", os.cpu_count() or 1))
 
-db_target_df = pd.read_csv("../data/raw/all_drugbank_drugs.csv")
-db_target_df['Name'] = db_target_df.Name.str.lower()
-print("Number of drugs:", db_target_df.Name.nunique())
-print("Number of targets:", db_target_df.Gene_Target.nunique())
+# the output of every stage is checkpointed here; a rerun resumes after the
+# last completed stage
+CHECKPOINT_DIR = "../data/out/checkpoints"
+# rerun the pipeline from this stage (and the stages after it) even if checkpointed
+FROM_STAGE = os.environ.get("CT_FROM_STAGE")
 
-print("N drugs with targets:", db_target_df[~db_target_df.Gene_Target.isna()].db_id.nunique())
-print(db_target_df.head())
+INTERVENTION_FILE = "../data/raw/intervention_ct_data.csv"
 
-# data cleaning to get drug names from text
-ids = []
-new_int = []
-int_type = []
-
-all_drugs_list = set(db_target_df.Name.tolist())
+###
+## Step 0: Load the interventions
+###
 
-start_time = time.time()
-for _, r in drug_df.iterrows():
+def load_interventions(path=INTERVENTION_FILE):
+    drug_df = read_table(path)
+    print("N trials:", drug_df.nct_id.nunique())
+    print("N interventions", drug_df.intervention.nunique())
+    print(drug_df.head())
+    return drug_df
 
-    if r['intervention_type'] != 'Drug':
-        continue
-        new_int.append(r['intervention'])
-        ids.append(r['nct_id'])
-        int_type.append(r['intervention_type'])
+###
+## Step 1: Map drug interventions to Drug Bank (Direct Matching)
+###
 
-    int_names = r['intervention'].split('/')
+# data cleaning to get drug names from text
+# drug names found in an intervention, split into fragments on '/' and ','
+def direct_drug_names(intervention, name_automaton):
+    int_names = intervention.split('/')
 
     int_names_2 = []
 
@@ -97,515 +102,421 @@ for _, r in drug_df.iterrows():
     tmp_l = set()
 
     for d_name in int_names_2:
-        for j in all_drugs_list:
-            if j in d_name:
-                if d_name.index(j) == 0 or d_name[d_name.index(j)-1] == ' ':
-                    tmp_l.add(j)
-
-    new_int.extend(list(tmp_l))
-    ids.extend([r['nct_id']]*len(tmp_l))
-    int_type.extend([r['intervention_type']]*len(tmp_l))
-
-print("time elapsed:", time.time() - start_time)
-drug_df_2 = pd.DataFrame({'nct_id':ids,'intervention':new_int, 'intervention_type':int_type})
-print(drug_df_2.head())
-
-print("Number of trials:", drug_df_2[drug_df_2.intervention_type=='Drug'].nct_id.nunique())
-print("Number of drugs:", drug_df_2[drug_df_2.intervention_type=='Drug'].intervention.nunique())
-print("---")
-print("original")
-print("Number of trials:", drug_df[drug_df.intervention_type=='Drug'].nct_id.nunique())
-print("Number of drugs:", drug_df[drug_df.intervention_type=='Drug'].intervention.nunique())
+        tmp_l.update(match_drug_names(d_name, name_automaton))
 
-####
-## Step 2: Map drug synonym
-####
+    return sorted(tmp_l)
 
-drug_synonym = pd.read_csv("../data/raw/drug_synonym.csv")
-drug_synonym.columns = ['db_id','synonym']
-drug_synonym = pd.merge(drug_synonym, db_target_df[['db_id','Name']], on='db_id')
-drug_synonym['synonym'] = drug_synonym.synonym.str.lower()
-drug_synonym = drug_synonym.drop_duplicates()
+# returns drug_df_2: the drug interventions mapped to the drugbank names they contain
+def map_direct(drug_df, drug_dict, mapping_cache):
+    db_target_df = drug_dict.targets
+    print("Number of drugs:", db_target_df.Name.nunique())
+    print("Number of targets:", db_target_df.Gene_Target.nunique())
 
-# remove synonyms with less than 5 letters
-drug_synonym['synonym'] = drug_synonym.synonym.apply(lambda x: 1 if len(x) <5 else x)
-drug_synonym = drug_synonym[drug_synonym.synonym != 1]
-drug_synonym['synonym'] = drug_synonym['synonym'].astype(str)
-drug_synonym['synonym'] = drug_synonym['synonym'].str.strip()
+    print("N drugs with targets:", db_target_df[~db_target_df.Gene_Target.isna()].db_id.nunique())
+    print(db_target_df.head())
 
-print("N drugs:", drug_synonym.Name.nunique())
-print("N synonym:", drug_synonym.synonym.nunique())
-print(drug_synonym.head())
+    # automaton over all drugbank names -- finds every name in a fragment in one pass
+    name_automaton = drug_dict.name_automaton
 
-#drug_synonym[drug_synonym.synonym.str.contains("interleukin-2")]
+    start_time = time.time()
 
-unmapped_interventions = drug_df[~drug_df.nct_id.isin(drug_df_2.nct_id)]
-unmapped_interventions = unmapped_interventions[unmapped_interventions.intervention_type=='Drug']
-print("N unmapped interventions:", unmapped_interventions.nct_id.nunique())
-print("N unmapped_drugs:", unmapped_interventions.intervention.nunique())
-print(unmapped_interventions.head())
+    drug_df_2 = drug_df[drug_df.intervention_type == 'Drug'][['nct_id','intervention','intervention_type']]
+    direct_hits = mapping_cache.cached('direct', drug_df_2.intervention,
+                                       lambda texts: {x: direct_drug_names(x, name_automaton) for x in texts})
 
-clean_drugs = []
-clean_nct_ids = []
-mapped_synonym_list = []
+    # one row per drug name found in the intervention
+    drug_df_2['intervention'] = drug_df_2.intervention.map(lambda x: direct_hits.get(x, []))
+    drug_df_2 = drug_df_2.explode('intervention').dropna(subset=['intervention']).reset_index(drop=True)
 
-n_synonym_error = 0
-start_time = time.time()
+    print("time elapsed:", time.time() - start_time)
+    print(drug_df_2.head())
 
-# loop through all synonyms pairs
-for _, r in drug_synonym.drop_duplicates().iterrows():
+    print("Number of trials:", drug_df_2[drug_df_2.intervention_type=='Drug'].nct_id.nunique())
+    print("Number of drugs:", drug_df_2[drug_df_2.intervention_type=='Drug'].intervention.nunique())
+    print("---")
+    print("original")
+    print("Number of trials:", drug_df[drug_df.intervention_type=='Drug'].nct_id.nunique())
+    print("Number of drugs:", drug_df[drug_df.intervention_type=='Drug'].intervention.nunique())
 
-    # check for rows that have the synonym in them
-    try:
-        tmp_df = unmapped_interventions[unmapped_interventions.intervention.str.contains(r['synonym'])]
-    except:
-        n_synonym_error+=1
-        #print(r['synonym'])
-        # unable to match
-        continue
+    return drug_df_2
+
+####
+## Step 2: Map drug synonym
+####
 
-    if len(tmp_df) >0 :
-        clean_nct_ids.extend(list(tmp_df.nct_id.unique()))
-        clean_drugs.extend([r['Name']]*tmp_df.nct_id.nunique())
-        mapped_synonym_list.extend([r['synonym']]*tmp_df.nct_id.nunique())
+# returns synonym_mapped_drug_df (nct_id, intervention, synonym) and the drug
+# interventions of the trials still unmapped
+def map_synonym(drug_df, drug_df_2, drug_dict, mapping_cache):
+    # lower case synonyms of at least 5 letters
+    drug_synonym = drug_dict.synonyms
 
-print("Time elapsed:", time.time() - start_time)
-print("N synonym unable to match", n_synonym_error)
-synonym_mapped_drug_df = pd.DataFrame({"nct_id":clean_nct_ids,'intervention':clean_drugs,
-                                       'synonym':mapped_synonym_list})
-print("Number of drugs mapped:", synonym_mapped_drug_df.intervention.nunique())
-print("Number of trials mapped:", synonym_mapped_drug_df.nct_id.nunique())
-print(synonym_mapped_drug_df.head())
+    print("N drugs:", drug_synonym.Name.nunique())
+    print("N synonym:", drug_synonym.synonym.nunique())
+    print(drug_synonym.head())
 
-synonym_mapped_drug_df[synonym_mapped_drug_df.synonym=='interleukin-2']
+    unmapped_interventions = drug_df[~drug_df.nct_id.isin(drug_df_2.nct_id)]
+    unmapped_interventions = unmapped_interventions[unmapped_interventions.intervention_type=='Drug']
+    print("N unmapped interventions:", unmapped_interventions.nct_id.nunique())
+    print("N unmapped_drugs:", unmapped_interventions.intervention.nunique())
+    print(unmapped_interventions.head())
 
-t_df = unmapped_interventions[~unmapped_interventions.nct_id.isin(synonym_mapped_drug_df.nct_id)]
+    start_time = time.time()
 
-unmapped_names = list(t_df.intervention.unique())
+    # all synonyms are matched (literally) against each distinct intervention in one pass
+    synonym_hits = mapping_cache.cached('synonym', unmapped_interventions.intervention,
+                                        lambda texts: {x: sorted(drug_dict.synonym_automaton.find_all(x)) for x in texts})
+    synonym_mapped_drug_df = map_synonyms(unmapped_interventions, drug_synonym, hits=synonym_hits)
+
+    print("Time elapsed:", time.time() - start_time)
+    print("Number of drugs mapped:", synonym_mapped_drug_df.intervention.nunique())
+    print("Number of trials mapped:", synonym_mapped_drug_df.nct_id.nunique())
+    print(synonym_mapped_drug_df.head())
+
+    t_df = unmapped_interventions[~unmapped_interventions.nct_id.isin(synonym_mapped_drug_df.nct_id)]
+
+    return synonym_mapped_drug_df, t_df
 
 ###
 ## Step 3: Map drug products
 ###
 
-drug_products = pd.read_csv("../data/raw/products.csv")
-drug_products['product_name'] = drug_products.product_name.str.lower()
-drug_products['Name'] = drug_products.Name.str.lower()
-print("N drugs:", drug_products.Name.nunique())
-print("N products:", drug_products.product_name.nunique())
-print(drug_products.head())
+# returns product_mapped_drug_df (nct_id, product) and the interventions of the
+# trials still unmapped
+def map_product(t_df, drug_dict, mapping_cache):
+    drug_products = drug_dict.products
+    print("N drugs:", drug_products.Name.nunique())
+    print("N products:", drug_products.product_name.nunique())
+    print(drug_products.head())
 
-print("Example:")
-print(drug_products[drug_products.product_name=='statin'])
+    print("Example:")
+    print(drug_products[drug_products.product_name=='statin'])
 
-products_list = set(drug_products.product_name.tolist())
-print("N products:", len(products_list))
+    products_list = drug_dict.product_list
+    print("N products:", len(products_list))
 
-clean_nct_ids = []
-mapped_product_list = []
+    start_time = time.time()
 
-n_product_error = 0
+    # all products are matched (literally) against each distinct intervention in one pass
+    t_nct_ids = t_df.nct_id.tolist()
+    product_hits = mapping_cache.cached('product', t_df.intervention,
+                                        lambda texts: {x: sorted(drug_dict.product_automaton.find_all(x)) for x in texts})
+    product_pairs = contains_pairs(t_df.intervention.tolist(), products_list, hits=product_hits)
 
-start_time = time.time()
+    print("Time elapsed:", time.time() - start_time)
+    product_mapped_drug_df = pd.DataFrame({"nct_id":[t_nct_ids[j] for _, j in product_pairs],
+                                           'product':[products_list[i] for i, _ in product_pairs]})
+    product_mapped_drug_df = product_mapped_drug_df.drop_duplicates()
+    print("Number of trials mapped:", product_mapped_drug_df.nct_id.nunique())
+    print(product_mapped_drug_df.head())
 
-# loop through all products
-for p in tqdm(products_list):
-    # check for rows that have the product in them
-    try:
-        tmp_df = t_df[t_df.intervention.str.contains(p)]
-    except:
-        n_product_error+=1
-        #print(r['product'])
-        # unable to match
-        continue
-
-    if len(tmp_df) >0:
-        clean_nct_ids.extend(list(tmp_df.nct_id.unique()))
-        #clean_drugs.extend([r['Name']]*tmp_df.nct_id.nunique())
-        mapped_product_list.extend([p]*tmp_df.nct_id.nunique())
-
-print("Time elapsed:", time.time() - start_time)
-print("N product unable to match", n_product_error)
-product_mapped_drug_df = pd.DataFrame({"nct_id":clean_nct_ids,
-                                       'product':mapped_product_list})
-#print("Number of drugs mapped:", synonym_mapped_drug_df.intervention.nunique())
-print("Number of trials mapped:", product_mapped_drug_df.nct_id.nunique())
-print(product_mapped_drug_df.head())
-
-unmapped_df = t_df[~t_df.nct_id.isin(product_mapped_drug_df.nct_id)]
-print("N trials unmapped:", unmapped_df.nct_id.nunique())
-print(unmapped_df.head())
+    unmapped_df = t_df[~t_df.nct_id.isin(product_mapped_drug_df.nct_id)]
+    print("N trials unmapped:", unmapped_df.nct_id.nunique())
+    print(unmapped_df.head())
+
+    return product_mapped_drug_df, unmapped_df
 
 ####
 ## Step 4: Map to External Identifier
 ####
 
-ext_ident_df = pd.read_csv("../data/raw/drugs_external_identifiers.csv")
-ext_ident_df = ext_ident_df[ext_ident_df.identifier_resource=='Wikipedia']
-ext_ident_df['identifier_name'] = ext_ident_df.identifier_name.str.lower()
-ext_ident_df['Name'] = ext_ident_df.Name.str.lower()
-print("N drugs:", ext_ident_df.nunique())
-print(ext_ident_df.head())
+# returns wiki_mapped_df (nct_id, intervention, intervention_type) and the
+# interventions of the trials still unmapped
+def map_external_identifier(unmapped_df, drug_dict, mapping_cache):
+    ext_ident_df = drug_dict.wiki_identifiers
+    print("N drugs:", ext_ident_df.nunique())
+    print(ext_ident_df.head())
 
-product_drug_dict = {k: list(v) for k, v in drug_products.groupby('product_name')['Name']}
+    start_time = time.time()
 
-nct_id_list = []
-db_id_list = []
-drug_name_list = []
-start_time = time.time()
+    # all identifiers are matched (literally) against each distinct intervention in one pass
+    unmapped_nct_ids = unmapped_df.nct_id.tolist()
+    wiki_names = ext_ident_df.Name.tolist()
+    wiki_hits = mapping_cache.cached('wikipedia', unmapped_df.intervention,
+                                     lambda texts: {x: sorted(drug_dict.wiki_automaton.find_all(x)) for x in texts})
+    wiki_pairs = contains_pairs(unmapped_df.intervention.tolist(), ext_ident_df.identifier_name.tolist(),
+                                hits=wiki_hits)
 
-for _,r in ext_ident_df.iterrows():
-    tmp_df = unmapped_df[unmapped_df.intervention.str.contains(r['identifier_name'])]
+    print("Time elapsed:", time.time() - start_time)
+    wiki_mapped_df = pd.DataFrame({'nct_id':[unmapped_nct_ids[j] for _, j in wiki_pairs],
+                                  'intervention':[wiki_names[i] for i, _ in wiki_pairs]})
+    wiki_mapped_df['intervention_type'] = 'Drug'
+    wiki_mapped_df = wiki_mapped_df.drop_duplicates()
 
-    for _, r2 in tmp_df.iterrows():
-        nct_id_list.append(r2['nct_id'])
-        db_id_list.append(r['db_id'])
-        drug_name_list.append(r['Name'])
+    print("N trials mapped:", wiki_mapped_df.nct_id.nunique())
+    print("N drugs mapped:", wiki_mapped_df.intervention.nunique())
+    print(wiki_mapped_df.head())
 
-print("Time elapsed:", time.time() - start_time)
-wiki_mapped_df = pd.DataFrame({'nct_id':nct_id_list,
-                              'intervention':drug_name_list})
-wiki_mapped_df['intervention_type'] = 'Drug'
-wiki_mapped_df = wiki_mapped_df.drop_duplicates()
+    unmapped_df = unmapped_df[~unmapped_df.nct_id.isin(wiki_mapped_df.nct_id)]
 
-print("N trials mapped:", wiki_mapped_df.nct_id.nunique())
-print("N drugs mapped:", wiki_mapped_df.intervention.nunique())
-print(wiki_mapped_df.head())
+    print("N trials unmapped:", unmapped_df.nct_id.nunique())
+    print(unmapped_df.head())
 
-unmapped_df = unmapped_df[~unmapped_df.nct_id.isin(wiki_mapped_df.nct_id)]
-
-print("N trials unmapped:", unmapped_df.nct_id.nunique())
-print(unmapped_df.head())
+    return wiki_mapped_df, unmapped_df
 
 ####
 ### Step 5: Fuzzy matching drug names
 ####
 
-drug_list = db_target_df.Name.unique()
-drug_list = list(drug_list)
-print("N drugs:", len(drug_list))
+# returns the unmapped interventions with map_intervention, the drug name at an
+# edit distance of 1 ('' if there is none)
+def map_fuzzy(unmapped_df, drug_dict, mapping_cache, n_workers=N_WORKERS):
+    print("N drugs:", len(drug_dict.drug_list))
 
-import Levenshtein
-from scipy.spatial.distance import pdist
+    # drug names within an edit distance of 4 of each unmapped intervention, looked up
+    # in a BK-tree over the drug names instead of comparing to every name
+    # the interventions are matched in batches across n_workers processes
+    def fuzzy_lookup(texts):
+        fuzzy_hits = {x: [] for x in texts}
+        rows = fuzzy_matches(texts, drug_dict.fuzzy_index, n_workers=n_workers)
+        for d, dist, x in zip(rows.match_drug, rows.distance, rows.intervention):
+            fuzzy_hits[x].append([d, int(dist)])
+        return fuzzy_hits
 
-# given an intervention find the change needed to attain a drug
-def get_closest_match(x):
-    match_drug = []
-    distance = []
-    for d in drug_list:
-        distance.append(Levenshtein.distance(x, d))
-        match_drug.append(d)
+    start_time = time.time()
+    unmapped_names = list(unmapped_df.intervention.unique())
+    fuzzy_hits = mapping_cache.cached('fuzzy', unmapped_names, fuzzy_lookup)
+    fuzzy_match = pd.DataFrame([(d, dist, x) for x in unmapped_names for d, dist in fuzzy_hits.get(x, [])],
+                               columns=['match_drug','distance','intervention'])
+    print("Time elapsed:", time.time() - start_time)
 
-    t_df = pd.DataFrame({'match_drug':match_drug,'distance':distance})
-    t_df['intervention'] = x
-    t_df = t_df[t_df.distance<5]
+    print(fuzzy_match.head())
+    # remove unmatched interventions
+    fuzzy_match= fuzzy_match.dropna()
 
-    return t_df
+    matched_dict = dict(zip(fuzzy_match[fuzzy_match.distance == 1].intervention,
+                           fuzzy_match[fuzzy_match.distance == 1].match_drug))
 
-fuzzy_match = pd.DataFrame()
+    unmapped_df = unmapped_df.copy()
+    unmapped_df['map_intervention'] = unmapped_df.intervention.map(matched_dict).fillna('')
 
-for u in tqdm(list(unmapped_df.intervention.unique())):
-    fuzzy_match = fuzzy_match.append(get_closest_match(u), ignore_index = True)
+    print("N trials mapped:", unmapped_df[unmapped_df.map_intervention != ''].nct_id.nunique())
+    print("N interventions:", unmapped_df[unmapped_df.map_intervention != ''].map_intervention.nunique())
 
-print(fuzzy_match.head())
-# remove unmatched interventions
-fuzzy_match= fuzzy_match.dropna()
+    return unmapped_df
 
-matched_dict = dict(zip(fuzzy_match[fuzzy_match.distance == 1].intervention,
-                       fuzzy_match[fuzzy_match.distance == 1].match_drug))
+### combine all mappings
+# the mappings of every step are concatenated at once; mapping_step records the
+# step that produced each row
+def combine_mappings(drug_df, drug_df_2, synonym_mapped_drug_df, product_mapped_drug_df,
+                     wiki_mapped_df, fuzzy_mapped_df, drug_dict, mapping_cache):
+    map_columns = ['nct_id','intervention','intervention_type','mapping_step']
 
-map_list = []
+    direct_map_df = drug_df_2.assign(mapping_step='direct')
 
-for _, r in unmapped_df.iterrows():
-    if r['intervention'] in matched_dict:
-        map_list.append(matched_dict[r['intervention']])
-    else:
-        map_list.append('')
+    # synonym mapping
+    synonym_map_df = synonym_mapped_drug_df[['nct_id','intervention']].assign(intervention_type='Drug',
+                                                                              mapping_step='synonym')
 
-unmapped_df['map_intervention'] = map_list
+    # product mapping -- a product maps to every drug it is made of
+    product_map_df = pd.merge(product_mapped_drug_df, drug_dict.products[['product_name','Name']],
+                              left_on='product', right_on='product_name')
+    product_map_df = product_map_df[['nct_id','Name']].rename(columns={'Name':'intervention'})
+    product_map_df = product_map_df.assign(intervention_type='Drug', mapping_step='product')
 
-print("N trials mapped:", unmapped_df[unmapped_df.map_intervention != ''].nct_id.nunique())
-print("N interventions:", unmapped_df[unmapped_df.map_intervention != ''].map_intervention.nunique())
+    # wiki mapping
+    wiki_map_df = wiki_mapped_df.assign(mapping_step='wikipedia')
 
-### combine all mappings
-final_drug_map_df = copy.deepcopy(drug_df_2)
-final_drug_map_df.index = range(len(final_drug_map_df))
+    final_drug_map_df = pd.concat([direct_map_df[map_columns], synonym_map_df[map_columns],
+                                   product_map_df[map_columns], wiki_map_df[map_columns]], ignore_index = True)
+    # a mapping found by several steps is kept for the first one
+    final_drug_map_df = final_drug_map_df.drop_duplicates(['nct_id','intervention','intervention_type'])
 
-# synonym mapping
-for _, r in synonym_mapped_drug_df.iterrows():
-    final_drug_map_df.loc[len(final_drug_map_df.index)] = [r['nct_id'],
-                                                           r['intervention'],
-                                                           'Drug']
+    # fuzzy matching
+    fuzzy_map_df = fuzzy_mapped_df[fuzzy_mapped_df.map_intervention != ''][['nct_id','intervention','intervention_type']]
+    fuzzy_map_df = fuzzy_map_df.assign(mapping_step='fuzzy')
+    final_drug_map_df = pd.concat([final_drug_map_df, fuzzy_map_df[map_columns]])
 
-# product mapping
-for _, r in product_mapped_drug_df.iterrows():
+    print("-----")
+    print("Final data counts:")
+    print("N Trials:", final_drug_map_df.nct_id.nunique())
+    print("N drugs:", final_drug_map_df.intervention.nunique())
 
-    drugs_mapped_list_tmp = product_drug_dict[r['product']]
 
-    for d in drugs_mapped_list_tmp:
-        final_drug_map_df.loc[len(final_drug_map_df.index)] = [r['nct_id'],
-                                                               d,
-                                                               'Drug']
-# wiki mapping
-final_drug_map_df = final_drug_map_df.append(wiki_mapped_df, ignore_index = True)
-final_drug_map_df = final_drug_map_df.drop_duplicates()
+    print("Proportion of Trials mapped:", final_drug_map_df.nct_id.nunique()/drug_df[drug_df.intervention_type=='Drug'].nct_id.nunique())
 
-# fuzzy matching
-final_drug_map_df = final_drug_map_df.append(unmapped_df[unmapped_df.map_intervention != ''][['nct_id',
-                                                                                             'intervention',
-                                                                                              'intervention_type']])
+    # match columns with drugbank
+    final_drug_map_df = final_drug_map_df.rename(columns={'intervention':'Name'})
 
-print("-----")
-print("Final data counts:")
-print("N Trials:", final_drug_map_df.nct_id.nunique())
-print("N drugs:", final_drug_map_df.intervention.nunique())
+    ### if you want to save the unmapped drug interventions
+    #unmapped_df = fuzzy_mapped_df[fuzzy_mapped_df.map_intervention == '']
+    #print("Example of unmapped intervention...")
+    #print(unmapped_df.head())
+    #unmapped_df.to_csv('ct_data/clean_data/unmapped_drug_trials.csv', index=False)
 
+    return final_drug_map_df
+
+####
+## Extra: Get placebo trials and drugs
+####
 
-print("Proportion of Trials mapped:", final_drug_map_df.nct_id.nunique()/drug_df[drug_df.intervention_type=='Drug'].nct_id.nunique())
+# returns final_placebo_trials (nct_id, drug_map, intervention_type): the trials
+# with a placebo of a drug
+def find_placebo_trials(drug_df, drug_dict, mapping_cache):
+    drug_synonym = drug_dict.synonyms
 
-# match columns with drugbank
-final_drug_map_df.columns = ['nct_id','Name','intervention_type']
+    placebo_trials = drug_df[(drug_df.intervention.str.contains("placebo")) & (drug_df.intervention_type=='Drug')]
+    print("Number of trials with placebos:", placebo_trials.nct_id.nunique())
+    print("number of interventions:", placebo_trials.intervention.nunique())
+    print(placebo_trials.head())
 
-# save file
-final_drug_map_df.to_csv("../data/out/drug_mapped_ct_data.csv", index=False)
+    # remove interventions that are not a placebo of a drug, e.g. phrases like
+    # placebo to/for/of, starting with placebo +/plus/and/or, ending with and/or/+ placebo,
+    # and a list of exact terms -- the rules are read from placebo_rules.csv
+    placebo_classifier = PlaceboClassifier.from_file()
+    placebo_trials_2 = placebo_trials[placebo_classifier.keep_mask(placebo_trials.intervention)]
 
-### if you want to save the unmapped drug interventions
-#unmapped_df = unmapped_df[unmapped_df.map_intervention == '']
-#print("Example of unmapped intervention...")
-#print(unmapped_df.head())
-#unmapped_df.to_csv('ct_data/clean_data/unmapped_drug_trials.csv', index=False)
+    placebo_trials_2 = placebo_trials_2.drop_duplicates()
+    print("Number of trials with placebos:", placebo_trials_2.nct_id.nunique())
+    print("number of interventions:", placebo_trials_2.intervention.nunique())
 
-####
-## Extra: Get placebo trials and drugs
-####
+    # tag the placebos with the drugs whose synonyms they contain
+    # all synonyms are matched (literally) against each distinct placebo string in one
+    # pass; pairs are ordered by synonym, then placebo, as in a loop over the synonyms
+    placebo_names = list(placebo_trials_2.intervention.unique())
+    placebo_hits = mapping_cache.cached('synonym', placebo_names,
+                                        lambda texts: {x: sorted(drug_dict.synonym_automaton.find_all(x)) for x in texts})
+    placebo_pairs = contains_pairs(placebo_names, drug_synonym.synonym.tolist(), hits=placebo_hits)
 
-placebo_trials = drug_df[(drug_df.intervention.str.contains("placebo")) & (drug_df.intervention_type=='Drug')]
-print("Number of trials with placebos:", placebo_trials.nct_id.nunique())
-print("number of interventions:", placebo_trials.intervention.nunique())
-print(placebo_trials.head())
-
-# remove phrases
-# placebo to, placebo for, placebo (for, placebo of
-# begins with: placebo +
-# ends with: and placebo, + placebo, or placebo
-
-placebo_trials_2 = placebo_trials[~(placebo_trials.intervention.str.contains("placebo for")) & ~(placebo_trials.intervention.str.contains("placebo (for", regex=False))]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.contains("placebo to")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.contains("placebo of")]
-
-# starts with
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo+")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo +")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo plus")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("plus placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo and")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo or")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo matching")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo replacement")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo matched")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo /")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.startswith("placebo/")]
-
-# ends with
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("+placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("+ placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("and placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("or placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("then placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("matching placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("/ placebo")]
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.str.endswith("/placebo")]
-
-# remove terms
-remove_terms_1 = ['placebo oral tablet',
- 'placebos',
- 'placebo oral capsule',
- 'matching placebo',
- 'placebo comparator',
- 'comparator: placebo',
- 'placebo gel',
- 'placebo tablet',
- 'placebo capsule',
- 'placebo patch',
- 'placebo capsules',
- 'placebo control',
- 'placebo tablets',
- 'placebo cream',
- 'placebo pill',
- 'oral placebo',
- 'saline placebo',
- 'placebo solution',
- 'comparator: placebo (unspecified)',
- 'placebo nasal spray',
- 'matched placebo',
- 'placebo injection',
- 'inhaled placebo',
- 'placebo group',
- 'intranasal placebo',
- 'placebo (saline)',
- 'placebo administration',
- 'placebo infusion',
- 'intravenous placebo',
- 'placebo iv',
- 'placebo (normal saline)',
- 'placebo ophthalmic solution',
- 'placebo - cap',
- 'placebo sc',
- 'moxifloxacin placebo',
- 'placebo treatment',
- 'placebo - concentrate',
- 'normal saline (placebo)',
- 'placebo ointment',
- 'placebo 2',
- 'placebo 1',
- 'iv placebo',
- 'placebo dpi',
- 'placebo drug',
- 'placebo - sc',
- 'placebo oral solution',
- 'placebo - iv',
- 'placebo arm']
-
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.isin(remove_terms_1)]
-
-remove_terms_2 = ['placebo (sugar pill)',
- 'placebo single dose',
- 'placebo eye drops',
- 'administration of placebo',
- 'placebo mouthwash',
- 'placebo saline',
- 'placebo pills',
- 'vehicle (placebo)',
- 'normal saline placebo',
- 'placebo spray',
- 'sugar pill (placebo)',
- 'placebo sugar pill',
- 'placebo inhaler',
- 'placebo iv infusion',
- 'placebo mdpi',
- 'placebo oil',
- 'placebo transdermal patch',
- 'placebo film',
- 'placebo (unspecified)',
- 'placebo.',
- 'placebo granules',
- 'lactose placebo',
- 'placebo (vehicle)',
- 'placebo comparator: placebo',
- 'placebo multiple doses',
- 'placebo po',
- 'sc placebo',
- 'placebo medication',
- 'placebo inhalation powder',
- 'hec placebo gel',
- 'placebo inhalation',
- 'placebo bid',
- 'placebo nasal aerosol',
- 'matching placebo tablets',
- 'b/f/taf placebo',
- 'placebo (saline solution)',
- 'placebo matched to atacicept',
- 'placebo vaginal gel',
- 'drug: placebo',
- 'ftc/tdf placebo']
-
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.isin(remove_terms_2)]
-
-remove_terms_3 = ['placebo mdi',
- 'placebo vaginal ring',
- 'placebo sl tablet',
- 'double-blind placebo',
- 'placebo suspension',
- 'pill placebo',
- 'placebo intravenous',
- 'placebo inhalation solution',
- 'saline (placebo)',
- 'placebo (high dose)',
- 'sitagliptin placebo',
- 'placebo intranasal spray',
- 'inactive placebo',
- 'placebo twice daily',
- 'placebo peel',
- 'placebo tablet to match 75 mg linzagolix tablet',
- 'placebo drops',
- 'placebo tablet to match 200 mg linzagolix tablet',
- 'placebo vaginal tablet',
- 'matching placebo patch',
- 'placebo first',
- 'placebo capsule to match add-back capsule',
- 'placebo (artificial tears)',
- 'placebo vehicle',
- 'topical placebo',
- 'srp plus placebo gel',
- 'placebo - capsule',
- 'e/c/f/tdf placebo',
- 'placebo powder',
- 'placebo 100 mg',
- 'placebo 40 mg',
- 'daily placebo',
- 'matching placebo tablet',
- 'group 1: placebo',
- 'placebo (sc)',
- 'matching placebo nasal spray',
- 'transdermal placebo patch',
- 'placebo multiple dose',
- 'placebo: normal saline',
- 'placebo 100mg',
- 'placebo control group',
- 'placebo collagen sponge',
- 'bkm120 matching placebo']
-
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.isin(remove_terms_3)]
-
-remove_terms_4 = ['placebo matched to ivacaftor',
-                  'placebo gas',
-                  'topical placebo cream',
-                  'placebo vaginal insert',
-                  'asa placebo',
-                  'placebo ointment (vehicle)',
-                  'matched placebos',
-                  'placebo (p)',
-                 'placebo tablets bid',
-                 'control: placebo',
- 'placebo (id)','control placebo (c)']
-
-placebo_trials_2 = placebo_trials_2[~placebo_trials_2.intervention.isin(remove_terms_4)]
-
-placebo_trials_2 = placebo_trials_2.drop_duplicates()
-print("Number of trials with placebos:", placebo_trials_2.nct_id.nunique())
-print("number of interventions:", placebo_trials_2.intervention.nunique())
-
-t = placebo_trials_2.intervention.value_counts().to_frame()
-
-tagged_drug_names = []
-synonym_mapped_names = []
-mapping_drug_names = []
-
-t = drug_synonym.drop_duplicates()
-
-for j in tqdm(range(len(t))):
+    synonym_names = drug_synonym.Name.tolist()
+    synonyms = drug_synonym.synonym.tolist()
+    tagged_drug_names = [placebo_names[j] for _, j in placebo_pairs]
+    mapping_drug_names = [synonym_names[i] for i, _ in placebo_pairs]
+    synonym_mapped_names = [synonyms[i] for i, _ in placebo_pairs]
 
-    try:
-        tmp_df = placebo_trials_2[placebo_trials_2.intervention.str.contains(t.iloc[j]['synonym'], regex=False)]
-    except:
-        continue
+    tmp_mapping_df = pd.DataFrame({'placebo_name':tagged_drug_names, 'drug_map':mapping_drug_names,'synonym_tagged':synonym_mapped_names})
+    print(tmp_mapping_df.head())
 
-    if len(tmp_df) > 0:
-        mapping_drug_names.extend([t.iloc[j]['Name']]*len(tmp_df))
-        synonym_mapped_names.extend([t.iloc[j]['synonym']]*len(tmp_df))
-        tagged_drug_names.extend(tmp_df.intervention.tolist())
+    tmp_mapping_df = tmp_mapping_df.drop_duplicates(['placebo_name','drug_map'])
 
-tmp_mapping_df = pd.DataFrame({'placebo_name':tagged_drug_names, 'drug_map':mapping_drug_names,'synonym_tagged':synonym_mapped_names})
-print(tmp_mapping_df.head())
+    synonym_mapping_dict = dict(zip(tmp_mapping_df.placebo_name, tmp_mapping_df.drug_map))
 
-tmp_mapping_df = tmp_mapping_df.drop_duplicates(['placebo_name','drug_map'])
+    final_placebo_trials = pd.merge(placebo_trials_2, tmp_mapping_df[['placebo_name', 'drug_map']], left_on='intervention',right_on='placebo_name')
+    final_placebo_trials = final_placebo_trials[['nct_id','drug_map','intervention_type']]
+    final_placebo_trials.head()
 
-synonym_mapping_dict = dict(zip(tmp_mapping_df.placebo_name, tmp_mapping_df.drug_map))
+    print("number of placebo trials:", final_placebo_trials.nct_id.nunique())
+    print("number of placebo drugs:", final_placebo_trials.drug_map.nunique())
 
-final_placebo_trials = pd.merge(placebo_trials_2, tmp_mapping_df[['placebo_name', 'drug_map']], left_on='intervention',right_on='placebo_name')
-final_placebo_trials = final_placebo_trials[['nct_id','drug_map','intervention_type']]
-final_placebo_trials.head()
+    return final_placebo_trials
 
-print("number of placebo trials:", final_placebo_trials.nct_id.nunique())
-print("number of placebo drugs:", final_placebo_trials.drug_map.nunique())
-final_placebo_trials.to_csv("../data/out/placebo_trials.csv", index = False)
+####
+## Pipeline
+####
 
+# stages in the order they run: (name, function, input names, output names)
+# every function also receives the drug dictionary and the mapping cache
+STAGES = [('direct', map_direct, ['drug_df'], ['drug_df_2']),
+          ('synonym', map_synonym, ['drug_df', 'drug_df_2'], ['synonym_mapped_drug_df', 't_df']),
+          ('product', map_product, ['t_df'], ['product_mapped_drug_df', 'product_unmapped_df']),
+          ('external_identifier', map_external_identifier, ['product_unmapped_df'],
+           ['wiki_mapped_df', 'wiki_unmapped_df']),
+          ('fuzzy', map_fuzzy, ['wiki_unmapped_df'], ['fuzzy_mapped_df']),
+          ('combine', combine_mappings, ['drug_df', 'drug_df_2', 'synonym_mapped_drug_df', 'product_mapped_drug_df',
+                                         'wiki_mapped_df', 'fuzzy_mapped_df'], ['final_drug_map_df']),
+          ('placebo', find_placebo_trials, ['drug_df'], ['final_placebo_trials'])]
+
+STAGE_NAMES = [s[0] for s in STAGES]
+
+def checkpoint_path(stage, checkpoint_dir=CHECKPOINT_DIR):
+    return os.path.join(checkpoint_dir, stage + '.pkl')
+
+# inputs of the run key that only some stages read; a change to any other input
+# makes every checkpoint stale
+KEY_STAGES = {'placebo_rules': ['placebo']}
+
+def file_key(path):
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+# drugbank release a mapping is cached under, with the versions of the indexes and
+# matching rules it was made with
+def cache_release(drug_dict):
+    return '%s:%d:%d' % (drug_dict.release, DICTIONARY_VERSION, MATCHING_VERSION)
+
+# identifies the inputs of a run: checkpoints of other inputs are stale
+def run_key(drug_dict, path=INTERVENTION_FILE, placebo_rules=PLACEBO_RULES_FILE):
+    return {'release': cache_release(drug_dict), 'interventions': file_key(table_path(path)),
+            'placebo_rules': file_key(placebo_rules)}
+
+# remove the checkpoints that were made from other inputs
+def check_run_key(key, checkpoint_dir=CHECKPOINT_DIR):
+    key_file = os.path.join(checkpoint_dir, 'run_key.json')
+    if os.path.exists(key_file):
+        with open(key_file) as f:
+            old_key = json.load(f)
+        changed = [k for k in key if old_key.get(k) != key[k]]
+        if not changed:
+            return
+
+        if all(k in KEY_STAGES for k in changed):
+            stale = [stage for k in changed for stage in KEY_STAGES[k]]
+        else:
+            stale = STAGE_NAMES
+        print("Inputs changed (%s), removing the checkpoints of: %s" % (', '.join(changed), ', '.join(stale)))
+        for stage in stale:
+            if os.path.exists(checkpoint_path(stage, checkpoint_dir)):
+                os.remove(checkpoint_path(stage, checkpoint_dir))
+
+    with open(key_file, 'w') as f:
+        json.dump(key, f)
+
+# outputs of a stage are written to a temporary file first, so an interrupted
+# write never leaves a checkpoint behind
+def save_checkpoint(stage, outputs, checkpoint_dir=CHECKPOINT_DIR):
+    path = checkpoint_path(stage, checkpoint_dir)
+    pd.to_pickle(outputs, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+# run every stage, loading the ones already checkpointed
+# from_stage forces that stage and all the later ones to run again
+# returns all the named inputs and outputs of the stages
+def run_pipeline(from_stage=FROM_STAGE, checkpoint_dir=CHECKPOINT_DIR, n_workers=N_WORKERS):
+    if from_stage is not None and from_stage not in STAGE_NAMES:
+        raise ValueError("unknown stage %s, expected one of %s" % (from_stage, STAGE_NAMES))
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    data = {'drug_df': load_interventions()}
+
+    # drugbank names, synonyms, products and identifiers with their matching indexes
+    # (loaded from ../data/out/drug_dictionary.pkl unless the drugbank files changed)
+    drug_dict = DrugDictionary.load_or_build()
+    print("DrugBank release:", drug_dict.release)
+
+    check_run_key(run_key(drug_dict), checkpoint_dir)
+
+    # matching results of every distinct intervention string, for this drugbank release
+    # and version of the dictionary and matching rules
+    # (saved to ../data/out/mapping_cache.sqlite and reused across runs)
+    mapping_cache = MappingCache(cache_release(drug_dict))
+
+    # once a stage runs, the checkpoints of the later stages are out of date
+    rerun = STAGE_NAMES.index(from_stage) if from_stage is not None else len(STAGES)
+    try:
+        for i, (stage, func, inputs, outputs) in enumerate(STAGES):
+            path = checkpoint_path(stage, checkpoint_dir)
+            if i < rerun and os.path.exists(path):
+                print("Stage %s: loaded from checkpoint" % stage)
+                data.update(pd.read_pickle(path))
+                continue
+            rerun = min(rerun, i)
+
+            print("Stage %s: running" % stage)
+            kwargs = {'n_workers': n_workers} if func is map_fuzzy else {}
+            result = func(*[data[k] for k in inputs], drug_dict, mapping_cache, **kwargs)
+            if len(outputs) == 1:
+                result = (result,)
+            stage_outputs = dict(zip(outputs, result))
+
+            save_checkpoint(stage, stage_outputs, checkpoint_dir)
+            data.update(stage_outputs)
+    finally:
+        mapping_cache.close()
+
+    # save files
+    write_table(data['final_drug_map_df'], "../data/out/drug_mapped_ct_data.csv")
+    write_table(data['final_placebo_trials'], "../data/out/placebo_trials.csv")
+
+    return data
+
+if __name__ == '__main__':
+    run_pipeline()
@@ -0,0 +1,141 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script loads the DrugBank names, synonyms, products and external identifiers
+## used to curate the drug interventions, normalizes them once and builds their
+## matching indexes
+## the dictionary is saved to ../data/out/drug_dictionary.pkl and rebuilt only when
+## one of the DrugBank files changes
+## Usage: from drug_dictionary import DrugDictionary
+##        drugs = DrugDictionary.load_or_build()
+"""
+
+# import packages
+import os
+import pickle
+import hashlib
+import pandas as pd
+from drug_matching import AhoCorasick, BKTree, match_drug_names
+
+DRUGBANK_FILES = {'drugs': "../data/raw/all_drugbank_drugs.csv",
+                  'synonyms': "../data/raw/drug_synonym.csv",
+                  'products': "../data/raw/products.csv",
+                  'identifiers': "../data/raw/drugs_external_identifiers.csv"}
+
+CACHE_FILE = "../data/out/drug_dictionary.pkl"
+# bumped whenever the indexes change, so older saved dictionaries are rebuilt
+DICTIONARY_VERSION = 3
+
+# size and mtime of the drugbank files, to tell when a saved dictionary is stale
+def file_stats(files=DRUGBANK_FILES):
+    stats = {}
+    for k, path in files.items():
+        stat = os.stat(path)
+        stats[k] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+# hash of the content of the drugbank files -- identifies the drugbank release
+def release_hash(files=DRUGBANK_FILES):
+    sha = hashlib.sha1()
+    for k in sorted(files):
+        with open(files[k], 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    return sha.hexdigest()[:16]
+
+class DrugDictionary:
+
+    def __init__(self, files=DRUGBANK_FILES):
+        self.version = DICTIONARY_VERSION
+        self.files = dict(files)
+        self.file_stats = file_stats(files)
+        self.release = release_hash(files)
+
+        ### drugs and their targets
+        db_target_df = pd.read_csv(files['drugs'])
+        db_target_df['Name'] = db_target_df.Name.str.lower()
+        self.targets = db_target_df
+
+        # drug names in the order they first appear
+        self.drug_list = list(db_target_df.Name.unique())
+        self.name_automaton = AhoCorasick(self.drug_list)
+        # edit distance index for the fuzzy matching
+        self.fuzzy_index = BKTree(self.drug_list)
+
+        ### synonyms
+        drug_synonym = pd.read_csv(files['synonyms'])
+        drug_synonym.columns = ['db_id','synonym']
+        drug_synonym = pd.merge(drug_synonym, db_target_df[['db_id','Name']], on='db_id')
+        drug_synonym['synonym'] = drug_synonym.synonym.str.lower()
+        drug_synonym = drug_synonym.drop_duplicates()
+
+        # remove synonyms with less than 5 letters
+        drug_synonym['synonym'] = drug_synonym.synonym.apply(lambda x: 1 if len(x) <5 else x)
+        drug_synonym = drug_synonym[drug_synonym.synonym != 1]
+        drug_synonym['synonym'] = drug_synonym['synonym'].astype(str)
+        drug_synonym['synonym'] = drug_synonym['synonym'].str.strip()
+
+        self.synonyms = drug_synonym.drop_duplicates()
+        self.synonym_drug_dict = {k: list(v) for k, v in self.synonyms.groupby('synonym', sort=False)['Name']}
+        self.synonym_automaton = AhoCorasick(self.synonyms.synonym.tolist())
+
+        ### products
+        drug_products = pd.read_csv(files['products'])
+        drug_products['product_name'] = drug_products.product_name.str.lower()
+        drug_products['Name'] = drug_products.Name.str.lower()
+
+        self.products = drug_products
+        self.product_list = sorted(set(drug_products.product_name.dropna().tolist()))
+        self.product_drug_dict = {k: list(v) for k, v in drug_products.groupby('product_name')['Name']}
+        self.product_automaton = AhoCorasick(self.product_list)
+
+        ### external identifiers (wikipedia)
+        ext_ident_df = pd.read_csv(files['identifiers'])
+        ext_ident_df = ext_ident_df[ext_ident_df.identifier_resource=='Wikipedia']
+        ext_ident_df['identifier_name'] = ext_ident_df.identifier_name.str.lower()
+        ext_ident_df['Name'] = ext_ident_df.Name.str.lower()
+
+        self.wiki_identifiers = ext_ident_df
+        self.wiki_automaton = AhoCorasick(ext_ident_df.identifier_name.tolist())
+
+    def save(self, path=CACHE_FILE):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path=CACHE_FILE):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    # load the saved dictionary, or build (and save) it if the drugbank files changed
+    @classmethod
+    def load_or_build(cls, files=DRUGBANK_FILES, path=CACHE_FILE):
+        if os.path.exists(path):
+            drugs = cls.load(path)
+            if (getattr(drugs, 'version', None) == DICTIONARY_VERSION and drugs.files == dict(files)
+                    and drugs.file_stats == file_stats(files)):
+                return drugs
+
+        drugs = cls(files)
+        drugs.save(path)
+        return drugs
+
+    ### lookups
+
+    # drug names found in a text (same word-start rule as the direct matching)
+    def find_names(self, text):
+        return match_drug_names(text.lower(), self.name_automaton)
+
+    # (synonym, drug name) pairs for the synonyms found in a text
+    def find_synonyms(self, text):
+        return [(s, name) for s in self.synonym_automaton.find_all(text.lower())
+                for name in self.synonym_drug_dict[s]]
+
+    # drug names of the products found in a text
+    def find_products(self, text):
+        return {name for p in self.product_automaton.find_all(text.lower())
+                for name in self.product_drug_dict[p]}
+
+    # (drug name, distance) of the drug names within max_distance edits of a text
+    def find_similar(self, text, max_distance=4):
+        return self.fuzzy_index.search(text.lower(), max_distance)
@@ -0,0 +1,306 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script holds the string matching used to map the trial interventions
+## to DrugBank names (see curate_drug_intervantions_ct.py)
+## Usage: from drug_matching import *
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import Levenshtein
+from tqdm import tqdm
+from multiprocessing import Pool
+from collections import defaultdict, deque
+
+# version of the matching rules (word starts, synonym length filter, fuzzy
+# distance, ...) -- bump it whenever a change alters what a string is matched to,
+# so cached matches of older versions are not reused (see mapping_cache.py)
+MATCHING_VERSION = 1
+
+# Aho-Corasick automaton over a list of patterns
+# all occurrences of all the patterns in a text are found in a single pass over
+# the text, instead of one substring scan per pattern
+# empty (or missing) patterns are ignored
+# once built, the automaton is kept as flat arrays (transitions in CSR form, with
+# their characters in one string), so it pickles and loads as a handful of
+# objects instead of one dict and one list per state; the transitions of a state
+# are decoded into a dict the first time a text reaches it
+class AhoCorasick:
+
+    def __init__(self, patterns):
+        self.patterns = []
+
+        # trie of the patterns: goto[state][char] -> state
+        goto = [{}]
+        # indexes of the patterns ending at each state
+        out = [[]]
+
+        pattern_ids = {}
+        for p in patterns:
+            if not isinstance(p, str) or not p or p in pattern_ids:
+                continue
+            pattern_ids[p] = len(self.patterns)
+            self.patterns.append(p)
+
+            state = 0
+            for c in p:
+                nxt = goto[state].get(c)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][c] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(pattern_ids[p])
+
+        # failure links, breadth first so the links of shallower states are known
+        fail = [0]*len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(c, 0)
+                # a state also ends every pattern its failure state ends
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        ### flat arrays
+        self._goto_ptr = np.zeros(len(goto) + 1, dtype=np.int32)
+        np.cumsum([len(g) for g in goto], out=self._goto_ptr[1:])
+        self._goto_chars = ''.join(c for g in goto for c in g)
+        self._goto_next = np.fromiter((nxt for g in goto for nxt in g.values()), dtype=np.int32,
+                                      count=self._goto_ptr[-1])
+        self._fail = np.array(fail, dtype=np.int32)
+        self._out_ptr = np.zeros(len(out) + 1, dtype=np.int32)
+        np.cumsum([len(o) for o in out], out=self._out_ptr[1:])
+        self._out_ids = np.fromiter((i for o in out for i in o), dtype=np.int32, count=self._out_ptr[-1])
+        self._states = {}
+
+    # the decoded states are not saved
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_states'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.patterns)
+
+    # (transitions, failure state, pattern indexes) of a state
+    def _state(self, state):
+        a, b = self._goto_ptr[state], self._goto_ptr[state+1]
+        o, p = self._out_ptr[state], self._out_ptr[state+1]
+        decoded = (dict(zip(self._goto_chars[a:b], self._goto_next[a:b].tolist())),
+                   int(self._fail[state]), self._out_ids[o:p].tolist())
+        self._states[state] = decoded
+        return decoded
+
+    # (start position, pattern index) of every occurrence, ordered by end position
+    def iter_matches(self, text):
+        states = self._states
+        patterns = self.patterns
+
+        state = 0
+        for end, c in enumerate(text, 1):
+            while True:
+                goto, fail, _ = states.get(state) or self._state(state)
+                nxt = goto.get(c)
+                if nxt is not None or not state:
+                    state = nxt or 0
+                    break
+                state = fail
+            for i in (states.get(state) or self._state(state))[2]:
+                yield end - len(patterns[i]), i
+
+    # the distinct patterns found in a text
+    def find_all(self, text):
+        return {self.patterns[i] for _, i in self.iter_matches(text)}
+
+# DrugBank names found in an intervention fragment
+# a name only counts if its first occurrence starts the fragment or follows a
+# space, the same word-start rule as the original name by name scan
+def match_drug_names(fragment, automaton):
+    first_start = {}
+    for start, i in automaton.iter_matches(fragment):
+        first_start.setdefault(i, start)
+
+    return {automaton.patterns[i] for i, start in first_start.items()
+            if start == 0 or fragment[start-1] == ' '}
+
+# (pattern row, text row) pairs for every pattern found in a text
+# patterns are matched literally; each distinct text is scanned once and the
+# pairs are ordered by pattern row, then text row, as a loop over the patterns
+# running str.contains on the texts would find them
+# hits ({text: patterns found}) can be given instead of scanning the texts again
+def contains_pairs(texts, patterns, automaton=None, hits=None):
+    if automaton is None and hits is None:
+        automaton = AhoCorasick(patterns)
+
+    pattern_rows = defaultdict(list)
+    for row, p in enumerate(patterns):
+        pattern_rows[p].append(row)
+
+    text_hits = {}
+    pairs = []
+    for text_row, text in enumerate(texts):
+        if not isinstance(text, str):
+            continue
+        if text not in text_hits:
+            found = hits[text] if hits is not None else automaton.find_all(text)
+            text_hits[text] = [row for p in found for row in pattern_rows[p]]
+        pairs.extend((row, text_row) for row in text_hits[text])
+
+    pairs.sort()
+    return pairs
+
+# map interventions to drugs through their synonyms
+# returns the trials whose interventions contain a synonym as (nct_id, intervention, synonym)
+# rows, with intervention the DrugBank name of the synonym -- one row per synonym and trial
+def map_synonyms(interventions_df, synonym_df, automaton=None, hits=None):
+    synonym_names = synonym_df.Name.tolist()
+    synonyms = synonym_df.synonym.tolist()
+    nct_ids = interventions_df.nct_id.tolist()
+
+    pairs = contains_pairs(interventions_df.intervention.tolist(), synonyms, automaton, hits)
+
+    clean_nct_ids = []
+    clean_drugs = []
+    mapped_synonym_list = []
+
+    seen = set()
+    for syn_row, int_row in pairs:
+        key = (syn_row, nct_ids[int_row])
+        if key in seen:
+            continue
+        seen.add(key)
+        clean_nct_ids.append(nct_ids[int_row])
+        clean_drugs.append(synonym_names[syn_row])
+        mapped_synonym_list.append(synonyms[syn_row])
+
+    return pd.DataFrame({"nct_id":clean_nct_ids, 'intervention':clean_drugs,
+                         'synonym':mapped_synonym_list})
+
+# BK-tree over a list of names for bounded edit distance (Levenshtein) search
+# the children of a node are keyed by their distance to it, so by the triangle
+# inequality a search only descends into children within max_distance of the
+# query's distance to the node instead of comparing the query to every name
+class BKTree:
+
+    def __init__(self, items):
+        self.items = []
+        self._root = None
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        if not isinstance(item, str):
+            return
+        i = len(self.items)
+        self.items.append(item)
+
+        # a node is (item index, {distance: child node})
+        if self._root is None:
+            self._root = (i, {})
+            return
+
+        node = self._root
+        while True:
+            d = Levenshtein.distance(item, self.items[node[0]])
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (i, {})
+                return
+            node = child
+
+    # (item, distance) of the items within max_distance of text, in the order
+    # the items were added -- the same rows as comparing text to every item
+    def search(self, text, max_distance):
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            i, children = stack.pop()
+            d = Levenshtein.distance(text, self.items[i])
+            if d <= max_distance:
+                found.append((i, d))
+            for k, child in children.items():
+                if d - max_distance <= k <= d + max_distance:
+                    stack.append(child)
+
+        found.sort()
+        return [(self.items[i], d) for i, d in found]
+
+# fuzzy index of a worker process, passed once when the worker starts
+_worker_fuzzy_index = None
+
+def _init_fuzzy_worker(fuzzy_index):
+    global _worker_fuzzy_index
+    _worker_fuzzy_index = fuzzy_index
+
+def _fuzzy_batch(args):
+    interventions, max_distance = args
+    return [(d, dist, x) for x in interventions for d, dist in _worker_fuzzy_index.search(x, max_distance)]
+
+# drug names within an edit distance of 4 (distance < 5) of each intervention
+# returns (match_drug, distance, intervention) rows, in the order of interventions
+# with n_workers > 1 the interventions are matched in batches across a process
+# pool; each worker receives the index once, not with every batch
+def fuzzy_matches(interventions, fuzzy_index, max_distance=4, n_workers=1, batch_size=200):
+    interventions = list(interventions)
+    batches = [(interventions[i:i+batch_size], max_distance) for i in range(0, len(interventions), batch_size)]
+
+    if n_workers > 1 and len(batches) > 1:
+        with Pool(n_workers, initializer=_init_fuzzy_worker, initargs=(fuzzy_index,)) as pool:
+            batch_rows = list(tqdm(pool.imap(_fuzzy_batch, batches), total=len(batches)))
+    else:
+        _init_fuzzy_worker(fuzzy_index)
+        batch_rows = [_fuzzy_batch(batch) for batch in tqdm(batches)]
+
+    rows = [row for batch in batch_rows for row in batch]
+    return pd.DataFrame(rows, columns=['match_drug','distance','intervention'])
+
+# rules that exclude an intervention from the placebo trials (see placebo_rules.csv)
+# rule is one of contains, startswith, endswith or exact
+PLACEBO_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "placebo_rules.csv")
+
+# classifies placebo interventions against a set of exclusion rules
+# the rules are compiled once: all the infixes into one automaton, the prefixes
+# and suffixes into tuples and the exact phrases into a set, so a string is
+# checked against every rule in a single call
+class PlaceboClassifier:
+
+    RULE_TYPES = ('contains', 'startswith', 'endswith', 'exact')
+
+    def __init__(self, rules):
+        rules = list(rules)
+        unknown = {r for r, _ in rules} - set(self.RULE_TYPES)
+        if unknown:
+            raise ValueError("unknown placebo rule types: %s" % sorted(unknown))
+
+        self.rules = rules
+        self._infixes = AhoCorasick([p for r, p in rules if r == 'contains'])
+        self._prefixes = tuple(p for r, p in rules if r == 'startswith')
+        self._suffixes = tuple(p for r, p in rules if r == 'endswith')
+        self._exact = {p for r, p in rules if r == 'exact'}
+
+    @classmethod
+    def from_file(cls, path=PLACEBO_RULES_FILE):
+        rules_df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        return cls(zip(rules_df.rule, rules_df.phrase))
+
+    # True if a rule excludes the intervention
+    def excluded(self, text):
+        return (text in self._exact or text.startswith(self._prefixes) or text.endswith(self._suffixes)
+                or next(self._infixes.iter_matches(text), None) is not None)
+
+    # boolean mask of the interventions that are kept -- each distinct string is
+    # classified once
+    def keep_mask(self, interventions):
+        kept = {x: not self.excluded(x) for x in interventions.unique()}
+        return interventions.map(kept).astype(bool)
@@ -8,6 +8,8 @@ Date = 03/15/2022
 ## and organizes them into readable csv files
 ### input: xml files of clinicaltrials.gov bulk download
 ### out: 1) organized_ct_data.csv 2) funder_ct_data.csv 3) intervention_ct_data.csv
+### (written as parquet instead with CT_STORAGE_FORMAT=parquet, see ct_storage.py)
+### set CT_INCREMENTAL=1 to only re-parse the trials that changed since the last run
 """
 
 # import packages
@@ -20,152 +22,229 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import time
 import copy
+import os
+import hashlib
+import posixpath
+import zipfile
+from functools import partial
+from collections import deque
+from multiprocessing import Pool
+from ct_storage import TableWriter, read_table, write_table, table_path
+from ct_dates import add_start_dates
 
 import warnings
 warnings.filterwarnings('ignore')
 
-# Get ClinicalTrials.Gov data
+# settings
+# read the trials straight out of the clinicaltrials.gov bulk download
+# (e.g. "../data/raw/AllPublicXML.zip") instead of the unzipped NCT*/*.xml files
+BULK_ZIP = os.environ.get("CT_BULK_ZIP")
+# number of worker processes used to parse the xml files (1 = serial)
+N_WORKERS = int(os.environ.get("CT_N_WORKERS", os.cpu_count() or 1))
+# number of files handed to a worker at a time
+WORKER_CHUNK_SIZE = 256
+# number of batches of files queued or parsed ahead of the writer, per worker
+# (bounds the memory used when writing falls behind the parsing)
+MAX_PENDING_BATCHES = 2
+# number of trials organized and written to the output files at a time
+CHUNK_SIZE = 20000
+# check the vectorized funder/intervention tables against the row by row loops
+CHECK_VECTORIZED = os.environ.get("CT_CHECK_VECTORIZED", "0") == "1"
+# only re-parse new or changed trials and merge them into the existing outputs
+INCREMENTAL = os.environ.get("CT_INCREMENTAL", "0") == "1"
+# write the funder, intervention, condition, mesh term, pmid and country rows of
+# each trial straight from the parser instead of splitting the ;-joined columns
+NORMALIZED = os.environ.get("CT_NORMALIZED", "0") == "1"
+
+# output files and the trial id column of each
+OUTPUT_FILES = {'trials': "../data/out/organized_ct_data.csv",
+                'funders': "../data/out/funder_ct_data.csv",
+                'interventions': "../data/raw/intervention_ct_data.csv"}
+ID_COLUMNS = {'trials': 'nct_id', 'funders': 'trial_id', 'interventions': 'nct_id'}
+
+# columns of the child tables emitted by organize_data(normalized=True)
+CHILD_COLUMNS = {'funders': ['trial_id','funder_name','funder_type','funder_role'],
+                 'interventions': ['nct_id','intervention','intervention_type'],
+                 'conditions': ['nct_id','condition'],
+                 'mesh_terms': ['nct_id','mesh_term'],
+                 'pmids': ['nct_id','pmid','pmid_source'],
+                 'countries': ['nct_id','country']}
+
+# extra output files of the normalized mode
+NORMALIZED_FILES = {'conditions': "../data/out/condition_ct_data.csv",
+                    'mesh_terms': "../data/out/mesh_term_ct_data.csv",
+                    'pmids': "../data/out/pmid_ct_data.csv",
+                    'countries': "../data/out/country_ct_data.csv"}
+if NORMALIZED:
+    OUTPUT_FILES = dict(OUTPUT_FILES, **NORMALIZED_FILES)
+    ID_COLUMNS = dict(ID_COLUMNS, **{k: 'nct_id' for k in NORMALIZED_FILES})
+
+# fingerprints of the xml files the outputs were built from
+MANIFEST_FILE = "../data/out/organized_ct_data.manifest.csv"
+MANIFEST_COLUMNS = ['trial_file','size','mtime','hash']
+
+# zip archives opened by this process, keyed by path
+_open_archives = {}
+
+# list the trial xml members of the bulk zip as (zip path, member name) sources
+def list_zip_trials(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        members = archive.namelist()
+    return [(zip_path, name) for name in members
+            if posixpath.basename(name).startswith('NCT') and name.endswith('.xml')]
+
+# open a trial xml -- a file on disk or a (zip path, member name) source
+def open_trial_xml(source):
+    if isinstance(source, tuple):
+        zip_path, member = source
+        # each process keeps its own handle so workers never share a file offset
+        if zip_path not in _open_archives:
+            _open_archives[zip_path] = zipfile.ZipFile(zip_path)
+        return _open_archives[zip_path].open(member)
+    return open(source, 'rb')
+
+# file name of a source, NCT*.xml
+def source_name(source):
+    if isinstance(source, tuple):
+        return posixpath.basename(source[1])
+    return os.path.basename(source)
+
+# get the xml fields of a given clinical trial (an xml path or a bulk zip member)
+# with normalized=True the child rows of the trial are returned as well
+# the file is streamed with iterparse in a single pass -- every direct child of
+# the root is inspected once its end tag is read and then cleared, so the tree
+# is never held in memory and no element is searched more than once
+def organize_data(ct_file_name, normalized=False):
+    # first value seen for single-valued fields
+    first = {}
 
-files_list = glob.glob("../data/raw/NCT*/*.xml")
-print("Number of Studies:", len(files_list))
-
-# get the xml fields of a given clinical trial
-def organize_data(ct_file_name):
-    # create element tree object
-    tree = ET.parse(ct_file_name)
-
-    # get root element
-    root = tree.getroot()
-
-    # trial id
-    nct_id = root.find('.//id_info//nct_id').text
-
-    # trial title
-    brief_title = root.find('.//brief_title').text
-
-    # lead sponsor
     lead_sponsors = []
     lead_sponsors_types = []
-
-    for sub_level in root.findall('.//sponsors//lead_sponsor'):
-        lead_sponsors.append(sub_level.find('agency').text)
-        if sub_level.find("agency_class") is not None:
-            lead_sponsors_types.append(sub_level.find('agency_class').text)
-        else:
-            lead_sponsors_types.append("NA")
-    lead_sponsors = ';'.join(lead_sponsors)
-    lead_sponsors_types = ';'.join(lead_sponsors_types)
-
-    # collaborators
     collaborators = []
     collaborators_types = []
+    location_countries = []
+    result_pubs = []
+    references = []
+    keywords = []
+    interventions = []
+    interventions_type = []
+    conditions = []
+    mesh_terms = []
+
+    # tags of the elements enclosing the current one (path[0] is the root)
+    path = []
+
+    with open_trial_xml(ct_file_name) as xml_file:
+        for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem.tag)
+                continue
+
+            path.pop()
+            if not path:
+                # end of the root element
+                break
+
+            tag = elem.tag
+            ancestors = path[1:]
+            top_level = len(path) == 1
+
+            # trial id and title
+            if tag == 'nct_id' and 'id_info' in ancestors:
+                first.setdefault('nct_id', elem.text)
+            elif tag == 'brief_title':
+                first.setdefault('brief_title', elem.text)
+
+            # lead sponsor and collaborators
+            elif tag in ('lead_sponsor', 'collaborator') and 'sponsors' in ancestors:
+                agency_class = elem.find('agency_class')
+                agency_class = agency_class.text if agency_class is not None else "NA"
+                if tag == 'lead_sponsor':
+                    lead_sponsors.append(elem.find('agency').text)
+                    lead_sponsors_types.append(agency_class)
+                else:
+                    collaborators.append(elem.find('agency').text)
+                    collaborators_types.append(agency_class)
+
+            ### eligibility
+            elif tag in ('gender', 'minimum_age', 'maximum_age') and 'eligibility' in ancestors:
+                first.setdefault(tag, elem.text)
+
+            ### intervention, condition a.k.a. disease and mesh terms
+            elif tag == 'intervention':
+                interventions.append(elem.find("intervention_name").text)
+                interventions_type.append(elem.find("intervention_type").text)
+            elif tag == 'condition':
+                conditions.append(elem.text)
+            elif tag == 'mesh_term':
+                mesh_terms.append(elem.text)
+
+            # the remaining fields are direct children of the root
+            elif top_level:
+                ### study location
+                if tag == 'location_countries':
+                    if elem.find("country") is not None:
+                        location_countries.append(elem.find("country").text)
+
+                ### publications
+                elif tag == 'results_reference':
+                    if elem.find("PMID") is not None:
+                        result_pubs.append(elem.find('PMID').text)
+                elif tag == 'reference':
+                    if elem.find("PMID") is not None:
+                        references.append(elem.find('PMID').text)
+
+                ### keywords
+                elif tag == 'keyword':
+                    keywords.append(elem.text)
+
+                ### status, phase, start date and study type
+                elif tag in ('overall_status', 'phase', 'start_date', 'study_type'):
+                    first.setdefault(tag, elem.text)
+
+            if top_level:
+                elem.clear()
+
+    nct_id = first.get('nct_id')
+    brief_title = first.get('brief_title')
+
+    # one row per element, so names containing ';' keep their types
+    if normalized:
+        child_tables = {
+            'funders': [(nct_id, n, t, 'lead') for n, t in zip(lead_sponsors, lead_sponsors_types)] +
+                       [(nct_id, n, t, 'collaborator') for n, t in zip(collaborators, collaborators_types)],
+            'interventions': [(nct_id, n, t) for n, t in zip(interventions, interventions_type)],
+            'conditions': [(nct_id, c) for c in conditions],
+            'mesh_terms': [(nct_id, m) for m in mesh_terms],
+            'pmids': [(nct_id, p, 'result') for p in result_pubs] + [(nct_id, p, 'reference') for p in references],
+            'countries': [(nct_id, c) for c in location_countries]}
 
-    for sub_level in root.findall('.//sponsors//collaborator'):
-        collaborators.append(sub_level.find('agency').text)
-        if sub_level.find('agency_class') is not None:
-            collaborators_types.append(sub_level.find("agency_class").text)
-        else:
-            collaborators_types.append("NA")
+    lead_sponsors = ';'.join(lead_sponsors)
+    lead_sponsors_types = ';'.join(lead_sponsors_types)
     collaborators = ';'.join(collaborators)
     collaborators_types = ';'.join(collaborators_types)
 
-    ### eligibility
-    gender = root.find(".//eligibility//gender")
-    if gender is not None:
-        gender = gender.text
-    else:
-        gender = ''
-
-    min_age = root.find(".//eligibility//minimum_age")
-    if min_age is not None:
-        min_age = min_age.text.split(' ')[0]
-    else:
-        min_age = ''
-
-    max_age = root.find(".//eligibility//maximum_age")
-    if max_age is not None:
-        max_age = max_age.text.split(' ')[0]
-    else:
-        max_age = ''
-
-    ### study location
-    location_countries = []
-
-    for sub_level in root.findall("location_countries"):
-        if sub_level.find("country") is not None:
-            location_countries.append(sub_level.find("country").text)
+    gender = first.get('gender', '')
+    min_age = first['minimum_age'].split(' ')[0] if 'minimum_age' in first else ''
+    max_age = first['maximum_age'].split(' ')[0] if 'maximum_age' in first else ''
 
     location_countries = ';'.join(location_countries)
-
-    ### publications
-    result_pubs = []
-
-    for sub_level in root.findall('results_reference'):
-        if sub_level.find("PMID") is not None:
-            result_pubs.append(sub_level.find('PMID').text)
-
     result_pubs = ';'.join(result_pubs)
-
-    references = []
-    for sub_level in root.findall("reference"):
-        if sub_level.find("PMID") is not None:
-            references.append(sub_level.find('PMID').text)
     references = ';'.join(references)
-
-    ### keywords
-    keywords = []
-
-    for sub_level in root.findall("keyword"):
-        keywords.append(sub_level.text)
     keywords = ";".join(keywords)
 
-
-    ### status, phase, and start date
-    if root.find("overall_status") is not None:
-        status = root.find("overall_status").text
-    else:
-        status = ''
-
-    if root.find("phase") is not None:
-        phase = root.find("phase").text
-    else:
-        phase = ""
-
-    if root.find("start_date") is not None:
-        start_date = root.find("start_date").text
-    else:
-        start_date = ''
-
-    ### intervention
-    interventions = []
-    interventions_type = []
-
-    for sub_level in root.findall('.//intervention'):
-        interventions.append(sub_level.find("intervention_name").text)
-        interventions_type.append(sub_level.find("intervention_type").text)
+    status = first.get('overall_status', '')
+    phase = first.get('phase', '')
+    start_date = first.get('start_date', '')
 
     interventions = ';'.join(interventions)
     intervention_types = ';'.join(interventions_type)
-
-    ### condition a.k.a. disease
-    conditions = []
-
-    for sub_level in root.findall('.//condition'):
-        conditions.append(sub_level.text)
     conditions = ';'.join(conditions)
+    mesh_terms = ';'.join(mesh_terms)
 
-    # mesh terms
-    mesh_terms = root.findall('.//mesh_term')
-
-    if len(mesh_terms) == 0:
-        mesh_terms = ''
-    else:
-        mesh_terms = ';'.join([term.text for term in mesh_terms])
-
-    # study type
-    study_type = root.find("study_type").text
+    study_type = first.get('study_type')
 
-    return {'nct_id':nct_id, 'title':brief_title,'study_type':study_type,'gender':gender,'min_age':min_age,'max_age':max_age,
+    record = {'nct_id':nct_id, 'title':brief_title,'study_type':study_type,'gender':gender,'min_age':min_age,'max_age':max_age,
             'lead_sponsors':lead_sponsors,'lead_sponsor_type':lead_sponsors_types,
             'collaborators':collaborators, 'collaborator_types':collaborators_types,
             'interventions':interventions,'intervention_types':intervention_types,
@@ -173,6 +252,10 @@ def organize_data(ct_file_name):
             'conditions':conditions,'keywords':keywords,'mesh_terms':mesh_terms,
            'result_pubs_pmid':result_pubs,'references_pmid':references}
 
+    if normalized:
+        return record, child_tables
+    return record
+
     """# print stuff
     print(nct_id, study_type)
     print(lead_sponsor, lead_sponsor_type)
@@ -194,17 +277,41 @@ def organize_data(ct_file_name):
 
     """
 
-trials_list = []
-df = pd.DataFrame()
-
-for file_n in tqdm(files_list):
-    trials_list.append(organize_data(file_n))
-
-df = df.append(trials_list)
-print(df.shape)
-print(df.head())
-
-df.to_csv("../data/out/organized_ct_data.csv", index = False)
+def _parse_batch(parse, files):
+    return [parse(file_n) for file_n in files]
+
+# parse the xml files, sharded across a pool of worker processes
+# records are yielded one at a time in the order of files_list
+# at most MAX_PENDING_BATCHES batches per worker are submitted ahead of the
+# records consumed, so neither the queued files nor the parsed records pile up
+def iter_trials(files_list, n_workers=N_WORKERS, parse=organize_data):
+    if n_workers > 1:
+        batches = iter_chunks(files_list, WORKER_CHUNK_SIZE)
+        with Pool(n_workers) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.apply_async(_parse_batch, (parse, batch)))
+                if len(pending) < n_workers*MAX_PENDING_BATCHES:
+                    continue
+                for record in pending.popleft().get():
+                    yield record
+            while pending:
+                for record in pending.popleft().get():
+                    yield record
+    else:
+        for file_n in files_list:
+            yield parse(file_n)
+
+# group a stream of records into lists of at most chunk_size records
+def iter_chunks(records, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 ## organize funder data
 
@@ -237,13 +344,6 @@ def organize_funder_data():
     return pd.DataFrame({'trial_id' : trial_id,'funder_name':funder_names,
                           'funder_type':funder_types,'funder_role':funder_roles})
 
-funder_df = organize_funder_data()
-funder_df = funder_df[funder_df.funder_name != '']
-funder_df.head()
-
-# save funder info
-funder_df.to_csv("../data/out/funder_ct_data.csv", index = False)
-
 ### organize intervention data
 
 def organize_intervention_data():
@@ -272,14 +372,247 @@ def organize_intervention_data():
 
     return pd.DataFrame({'nct_id':nct_id,'intervention':intervention_names,'intervention_type':intervention_types})
 
-drug_df = organize_intervention_data()
-drug_df['intervention']= drug_df.intervention.str.lower()
-drug_df = drug_df.drop_duplicates()
+# vectorized organize_funder_data() -- the ;-joined collaborator strings are
+# split and exploded column-wise; lead sponsors are kept whole as in the loop
+def organize_funder_data_vectorized(df):
+    lead_df = pd.DataFrame({'trial_id':df.nct_id, 'funder_name':df.lead_sponsors,
+                            'funder_type':df.lead_sponsor_type, 'funder_role':'lead'})
 
-remove_interventions = ['placebo','no intervention']
-drug_df = drug_df[~drug_df.intervention.isin(remove_interventions)]
-print(drug_df.shape)
-print(drug_df.head())
+    collab_df = df[df.collaborators.notna()]
+    if len(collab_df) > 0:
+        names = collab_df.collaborators.str.split(';')
+        types = collab_df.collaborator_types.str.split(';')
+
+        # collaborators whose types do not line up with the names get 'na' types
+        n_names = names.str.len()
+        types = types.where(n_names == types.str.len(), n_names.map(lambda n: ['na']*n))
+
+        collab_df = pd.DataFrame({'trial_id':collab_df.nct_id, 'funder_name':names,
+                                  'funder_type':types, 'funder_role':'collaborator'})
+        collab_df = collab_df.explode(['funder_name','funder_type'])
+    else:
+        collab_df = lead_df.iloc[:0]
 
-# save file
-drug_df.to_csv("../data/raw/intervention_ct_data.csv")
+    # the stable sort keeps each lead sponsor ahead of its trial's collaborators
+    funder_df = pd.concat([lead_df, collab_df]).sort_index(kind='mergesort')
+    return funder_df.reset_index(drop=True)
+
+# vectorized organize_intervention_data() -- trials without interventions or
+# with a different number of interventions and intervention types are skipped
+def organize_intervention_data_vectorized(df):
+    int_df = df[df.interventions.notna()]
+    names = int_df.interventions.str.split(';')
+    types = int_df.intervention_types.str.split(';')
+    aligned = names.str.len() == types.str.len()
+
+    counter = (len(df) - len(int_df)) + int((~aligned).sum())
+    print("Number of trials without interventions or intervention types:", counter)
+
+    int_df = pd.DataFrame({'nct_id':int_df.nct_id[aligned], 'intervention':names[aligned],
+                           'intervention_type':types[aligned]})
+    int_df = int_df.explode(['intervention','intervention_type'])
+    return int_df.reset_index(drop=True)
+
+# compare the vectorized tables with the row by row loops on the current df
+def check_vectorized_outputs():
+    pd.testing.assert_frame_equal(organize_funder_data_vectorized(df), organize_funder_data())
+    pd.testing.assert_frame_equal(organize_intervention_data_vectorized(df), organize_intervention_data())
+    print("Vectorized funder and intervention data match the loops")
+
+# organize the trials of files_list and write them chunk by chunk to out_files
+# so memory use does not grow with the number of trials
+def write_outputs(files_list, out_files=OUTPUT_FILES):
+    global df
+
+    n_trials = 0
+    n_intervention_rows = 0
+
+    parse = partial(organize_data, normalized=True) if NORMALIZED else organize_data
+
+    # the intervention csv has always been written with its index
+    writers = {k: TableWriter(path, index=(k == 'interventions')) for k, path in out_files.items()}
+
+    try:
+        for trials_chunk in tqdm(iter_chunks(iter_trials(files_list, parse=parse)),
+                                 total=-(-len(files_list)//CHUNK_SIZE)):
+            if NORMALIZED:
+                child_dfs = {k: pd.DataFrame([row for _, tables in trials_chunk for row in tables[k]], columns=columns)
+                             for k, columns in CHILD_COLUMNS.items()}
+                trials_chunk = [record for record, _ in trials_chunk]
+
+            # start dates are also saved as typed start_month, start_year and start_datetime
+            df = add_start_dates(pd.DataFrame(trials_chunk))
+            n_trials += len(df)
+            writers['trials'].write(df)
+
+            if NORMALIZED:
+                funder_df = child_dfs['funders']
+                drug_df = child_dfs['interventions']
+                for k in NORMALIZED_FILES:
+                    writers[k].write(child_dfs[k])
+            else:
+                if CHECK_VECTORIZED:
+                    check_vectorized_outputs()
+
+                funder_df = organize_funder_data_vectorized(df)
+                funder_df = funder_df[funder_df.funder_name != '']
+                drug_df = organize_intervention_data_vectorized(df)
+
+            # save funder info
+            writers['funders'].write(funder_df)
+
+            # number the rows as if all the trials were organized at once
+            drug_df.index = drug_df.index + n_intervention_rows
+            n_intervention_rows += len(drug_df)
+
+            drug_df['intervention']= drug_df.intervention.str.lower()
+            drug_df = drug_df.drop_duplicates()
+
+            remove_interventions = ['placebo','no intervention']
+            drug_df = drug_df[~drug_df.intervention.isin(remove_interventions)]
+
+            # save file
+            writers['interventions'].write(drug_df)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return n_trials
+
+### incremental extraction
+
+def read_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_csv(MANIFEST_FILE, dtype={'trial_file':str, 'hash':str})
+
+# size, mtime and content hash of every source
+# zip members carry a CRC32 in the archive index; files on disk have to be read
+# to be hashed, so their previous hash is reused while size and mtime are unchanged
+def fingerprint_sources(files_list, manifest):
+    previous = dict(zip(manifest.trial_file, zip(manifest['size'], manifest.mtime, manifest.hash)))
+    zip_infos = {}
+
+    trial_files = []
+    sizes = []
+    mtimes = []
+    hashes = []
+
+    for source in tqdm(files_list):
+        name = source_name(source)
+
+        if isinstance(source, tuple):
+            zip_path, member = source
+            if zip_path not in zip_infos:
+                with zipfile.ZipFile(zip_path) as archive:
+                    zip_infos[zip_path] = {info.filename: info for info in archive.infolist()}
+            info = zip_infos[zip_path][member]
+            size = info.file_size
+            mtime = int('%04d%02d%02d%02d%02d%02d' % info.date_time)
+            file_hash = '%08x' % info.CRC
+        else:
+            stat = os.stat(source)
+            size = stat.st_size
+            mtime = stat.st_mtime_ns
+            if name in previous and previous[name][:2] == (size, mtime):
+                file_hash = previous[name][2]
+            else:
+                with open(source, 'rb') as f:
+                    file_hash = hashlib.sha1(f.read()).hexdigest()
+
+        trial_files.append(name)
+        sizes.append(size)
+        mtimes.append(mtime)
+        hashes.append(file_hash)
+
+    return pd.DataFrame({'trial_file':trial_files, 'size':sizes, 'mtime':mtimes, 'hash':hashes})
+
+# replace the rows of stale trials in an output file with the rows in new_path
+def merge_output(path, new_path, id_col, stale_ids, index_col=None):
+    # read csv files as text so the untouched rows are written back unchanged
+    read_kwargs = {'dtype':str, 'keep_default_na':False, 'index_col':index_col}
+    old_df = read_table(path, **read_kwargs)
+    old_df = old_df[~old_df[id_col].isin(stale_ids)]
+
+    if os.path.exists(table_path(new_path)):
+        new_df = read_table(new_path, **read_kwargs)
+        os.remove(table_path(new_path))
+    else:
+        new_df = old_df.iloc[:0]
+
+    merged_df = pd.concat([old_df, new_df])
+    merged_df = merged_df.sort_values(id_col, kind='mergesort').reset_index(drop=True)
+    write_table(merged_df, path, index = index_col is not None)
+
+# re-parse only the trials that were added or changed since the last run
+def update_outputs(files_list, manifest, fingerprints):
+    compare_df = pd.merge(fingerprints, manifest[['trial_file','hash']], on='trial_file',
+                          how='outer', suffixes=('','_old'), indicator=True)
+    added = compare_df[compare_df._merge == 'left_only'].trial_file
+    removed = compare_df[compare_df._merge == 'right_only'].trial_file
+    updated = compare_df[(compare_df._merge == 'both') & (compare_df.hash != compare_df.hash_old)].trial_file
+
+    print("Trials added:", len(added))
+    print("Trials updated:", len(updated))
+    print("Trials removed:", len(removed))
+    print("Trials unchanged (skipped):", len(fingerprints) - len(added) - len(updated))
+
+    # trial files are named after the trial id
+    stale_ids = set(os.path.splitext(f)[0] for f in pd.concat([updated, removed]))
+    parse_files = set(added) | set(updated)
+    parse_list = [source for source in files_list if source_name(source) in parse_files]
+
+    new_files = {k: '%s.new%s' % os.path.splitext(v) for k, v in OUTPUT_FILES.items()}
+    n_trials = write_outputs(parse_list, new_files)
+
+    for k in OUTPUT_FILES:
+        merge_output(OUTPUT_FILES[k], new_files[k], ID_COLUMNS[k], stale_ids,
+                     index_col=0 if k == 'interventions' else None)
+
+    return n_trials
+
+# the guard keeps the worker processes from re-running the script on import
+if __name__ == '__main__':
+
+    # Get ClinicalTrials.Gov data
+
+    if BULK_ZIP:
+        files_list = list_zip_trials(BULK_ZIP)
+    else:
+        files_list = glob.glob("../data/raw/NCT*/*.xml")
+    print("Number of Studies:", len(files_list))
+
+    # sorting by file name (NCT*.xml) keeps the output sorted by nct_id
+    files_list = sorted(files_list, key=source_name)
+
+    incremental = INCREMENTAL and os.path.exists(MANIFEST_FILE) and all(os.path.exists(table_path(f)) for f in OUTPUT_FILES.values())
+    manifest = read_manifest() if incremental else pd.DataFrame(columns=MANIFEST_COLUMNS)
+
+    # the manifest describes the outputs, so it is dropped until they are rewritten:
+    # a run that fails part way makes the next incremental run start over
+    if os.path.exists(MANIFEST_FILE):
+        os.remove(MANIFEST_FILE)
+
+    start_time = time.time()
+
+    # the sources are only fingerprinted when the manifest is used: the first
+    # CT_INCREMENTAL=1 run parses everything and writes the manifest for the next ones
+    fingerprints = fingerprint_sources(files_list, manifest) if INCREMENTAL else None
+
+    if incremental:
+        n_trials = update_outputs(files_list, manifest, fingerprints)
+    else:
+        # a full run writes next to the outputs and only replaces them once every chunk is written
+        new_files = {k: '%s.new%s' % os.path.splitext(v) for k, v in OUTPUT_FILES.items()}
+        n_trials = write_outputs(files_list, new_files)
+        for k in OUTPUT_FILES:
+            os.replace(table_path(new_files[k]), table_path(OUTPUT_FILES[k]))
+
+    if fingerprints is not None:
+        fingerprints.to_csv(MANIFEST_FILE, index = False)
+
+    elapsed = time.time() - start_time
+    print("Workers:", N_WORKERS)
+    print("Number of trials parsed:", n_trials)
+    print("Time elapsed:", elapsed)
+    print("Throughput (files/sec):", n_trials/max(elapsed, 1e-9))
@@ -0,0 +1,92 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script caches what each intervention string was matched to
+## results are keyed by the DrugBank release (with the dictionary and matching
+## versions, so a change to the matching is not served old results), the matching
+## step and the string;
+## the most recently used ones are kept in memory (bounded LRU) and all of them
+## are saved to a sqlite file, so curation only matches the distinct strings it
+## has not seen before -- also when it is rerun on a new clinical trials snapshot
+## Usage: from mapping_cache import MappingCache
+"""
+
+# import packages
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+
+CACHE_FILE = "../data/out/mapping_cache.sqlite"
+
+# number of (step, string) results kept in memory, in total across the steps
+MAX_MEMORY_ENTRIES = int(os.environ.get("CT_CACHE_SIZE", 200000))
+
+# sqlite limits the number of parameters of a query
+QUERY_BATCH_SIZE = 500
+
+class MappingCache:
+
+    def __init__(self, release, path=CACHE_FILE, max_size=MAX_MEMORY_ENTRIES):
+        self.release = release
+        self.max_size = max_size
+        self._memory = OrderedDict()
+
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS mappings "
+                         "(release TEXT, step TEXT, text TEXT, value TEXT, "
+                         "PRIMARY KEY (release, step, text))")
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    # cached values of the given strings, from memory or else from disk
+    def get_many(self, step, texts):
+        found = {}
+        missing = []
+        for text in texts:
+            key = (step, text)
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                found[text] = self._memory[key]
+            else:
+                missing.append(text)
+
+        for i in range(0, len(missing), QUERY_BATCH_SIZE):
+            batch = missing[i:i+QUERY_BATCH_SIZE]
+            rows = self._db.execute("SELECT text, value FROM mappings WHERE release = ? AND step = ? "
+                                    "AND text IN (%s)" % ','.join('?'*len(batch)),
+                                    [self.release, step] + batch)
+            for text, value in rows:
+                found[text] = json.loads(value)
+                self._remember((step, text), found[text])
+
+        return found
+
+    def put_many(self, step, values):
+        self._db.executemany("INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?)",
+                             [(self.release, step, text, json.dumps(value)) for text, value in values.items()])
+        self._db.commit()
+        for text, value in values.items():
+            self._remember((step, text), value)
+
+    # values of all the (string) texts -- compute(texts) returns {text: value} and
+    # is only called with the distinct texts that are not cached yet
+    def cached(self, step, texts, compute):
+        texts = list(dict.fromkeys(t for t in texts if isinstance(t, str)))
+
+        found = self.get_many(step, texts)
+        missing = [t for t in texts if t not in found]
+        print("%s matching: %d strings cached, %d to match" % (step, len(found), len(missing)))
+
+        if missing:
+            computed = compute(missing)
+            self.put_many(step, computed)
+            found.update(computed)
+        return found
+
+    def close(self):
+        self._db.close()
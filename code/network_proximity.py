@@ -0,0 +1,230 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script computes the network proximity of drugs to a set of genes (e.g. the
+## genes of a disease) on the PPI network
+## the proximity of a drug is the closest distance: the mean, over the targets of
+## the drug, of the shortest path distance to the nearest gene of the set,
+## compared to degree-preserving random gene and target sets as a z-score
+## distances come from multi-source breadth first searches over the CSR arrays of
+## a CSRGraph (see ppi_graph.py): one search from the whole gene set, and one from
+## each of its random sets, gives the distance of every gene to the nearest gene
+## of the set; the searches run once, across worker processes, and are shared by
+## all the drugs
+## Usage: from network_proximity import ProximityCalculator, drug_targets
+##        calc = ProximityCalculator(ppi_csr, disease_genes)
+##        calc.proximities(drug_targets(dt_trial_df))
+"""
+
+# import packages
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from multiprocessing import Pool
+
+# settings
+# number of worker processes used for the breadth first searches (1 = serial)
+N_WORKERS = int(os.environ.get("CT_N_WORKERS", os.cpu_count() or 1))
+
+# distance stored for genes that cannot be reached
+UNREACHABLE = np.iinfo(np.int8).max
+
+# shortest path distance from the nearest of the sources to every gene
+# (sources are gene indexes; unreachable genes get -1)
+# the whole frontier is expanded at once, level by level
+def bfs_distances(graph, sources):
+    indptr = graph.indptr
+    indices = graph.indices
+
+    dist = np.full(len(graph), -1, dtype=np.int32)
+    frontier = np.unique(np.asarray(sources, dtype=np.int64))
+    dist[frontier] = 0
+
+    d = 0
+    while len(frontier):
+        d += 1
+        # neighbors of all the frontier genes
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        neighbors = indices[offsets + np.arange(counts.sum())]
+
+        frontier = np.unique(neighbors[dist[neighbors] < 0])
+        dist[frontier] = d
+    return dist
+
+# graph of a worker process, passed once when the worker starts
+_worker_graph = None
+
+def _init_bfs_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+# distance rows of a batch of gene sets, already int8 so only the small rows
+# are sent back and kept
+def _distance_block(gene_sets):
+    block = np.stack([bfs_distances(_worker_graph, genes) for genes in gene_sets])
+    block[block < 0] = UNREACHABLE
+    return block.astype(np.int8)
+
+# distance from every gene to the nearest gene of each of the gene sets, one row
+# per set (int8, with UNREACHABLE for the genes that cannot be reached)
+# with n_workers > 1 the searches run in batches across a process pool
+def distance_rows(graph, gene_sets, n_workers=N_WORKERS, batch_size=100):
+    gene_sets = list(gene_sets)
+    batches = [gene_sets[i:i+batch_size] for i in range(0, len(gene_sets), batch_size)]
+
+    if n_workers > 1 and len(batches) > 1:
+        with Pool(n_workers, initializer=_init_bfs_worker, initargs=(graph,)) as pool:
+            blocks = list(tqdm(pool.imap(_distance_block, batches), total=len(batches)))
+    else:
+        _init_bfs_worker(graph)
+        blocks = [_distance_block(batch) for batch in tqdm(batches)]
+
+    return np.concatenate(blocks) if blocks else np.empty((0, len(graph)), dtype=np.int8)
+
+# bin of every gene by degree: genes of the same degree share a bin, and bins are
+# merged (in order of degree) until they hold at least min_bin_size genes
+def degree_bins(graph, min_bin_size=100):
+    degree = graph.degree()
+    bins = np.empty(len(degree), dtype=np.int64)
+
+    members = []
+    current = []
+    for k in np.unique(degree):
+        current.extend(np.flatnonzero(degree == k))
+        if len(current) >= min_bin_size:
+            members.append(current)
+            current = []
+    # the last genes join the last bin if they are too few
+    if current:
+        if members:
+            members[-1].extend(current)
+        else:
+            members.append(current)
+
+    for b, genes in enumerate(members):
+        bins[genes] = b
+    return bins, [np.array(genes, dtype=np.int64) for genes in members]
+
+# n_random gene sets with the degrees of genes: every gene is replaced by a
+# different gene of its degree bin (without repeats within a set)
+# returns an (n_random, len(genes)) array of gene indexes
+def random_gene_sets(genes, bins, bin_members, n_random, rng):
+    genes = np.asarray(genes, dtype=np.int64)
+    sets = np.empty((n_random, len(genes)), dtype=np.int64)
+    for b in np.unique(bins[genes]):
+        positions = np.flatnonzero(bins[genes] == b)
+        members = bin_members[b]
+        k = len(positions)
+        if k*k <= len(members):
+            # few genes from a large bin: draw k members per row and draw the rows
+            # with a repeat again (repeats are rare, and a redraw keeps the sets uniform)
+            picks = rng.integers(len(members), size=(n_random, k))
+            while k > 1:
+                ordered = np.sort(picks, axis=1)
+                repeated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+                if not repeated.any():
+                    break
+                picks[repeated] = rng.integers(len(members), size=(repeated.sum(), k))
+        elif k <= len(members):
+            # the members with the k smallest random keys of each row
+            keys = rng.random((n_random, len(members)), dtype=np.float32)
+            picks = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        else:
+            # more genes than the bin holds, so some are repeated
+            picks = rng.integers(len(members), size=(n_random, len(positions)))
+        sets[:, positions] = members[picks]
+    return sets
+
+# targets of every drug in a trial table (e.g. read_data's dt_trial_df)
+def drug_targets(dt_trial_df, drug_col='intervention', target_col='Gene_Target'):
+    targets = dt_trial_df[[drug_col, target_col]].dropna().drop_duplicates()
+    return {drug: sorted(genes) for drug, genes in targets.groupby(drug_col)[target_col]}
+
+# calculator of a worker process, passed once when the worker starts
+_worker_calculator = None
+
+def _init_proximity_worker(calculator):
+    global _worker_calculator
+    _worker_calculator = calculator
+
+def _proximity(targets):
+    return _worker_calculator.proximity(targets)
+
+# proximity of drugs to one set of genes
+# the distance rows of the gene set and of its n_random degree-matched random
+# sets are computed once; every drug is then scored by reading its targets in the
+# row of the set, and its own random target sets in the rows of the random sets
+class ProximityCalculator:
+
+    def __init__(self, graph, genes, n_random=1000, min_bin_size=100, seed=0, n_workers=N_WORKERS):
+        self.graph = graph
+        self.n_random = n_random
+        self.seed = seed
+        self.n_workers = n_workers
+
+        gene_ids = graph.indexes(genes)
+        self.genes = np.unique(gene_ids[gene_ids >= 0])
+        if len(self.genes) == 0:
+            raise ValueError("none of the genes are in the network")
+
+        self.bins, self.bin_members = degree_bins(graph, min_bin_size)
+        rng = np.random.default_rng(seed)
+        random_sets = random_gene_sets(self.genes, self.bins, self.bin_members, n_random, rng)
+
+        # one distance row for the gene set and one per random set, shared by all the drugs
+        print("Distance rows to compute:", n_random + 1)
+        self.rows = distance_rows(graph, [self.genes] + list(random_sets), n_workers=n_workers)
+
+    # closest distance of each set of targets (gene indexes, one set per row) to
+    # the gene set of the same row of rows, averaged over the targets
+    @staticmethod
+    def _closest(rows, targets):
+        d = np.take_along_axis(rows, targets, axis=1)
+        # targets that cannot reach the gene set are left out (nan if none can)
+        reached = d != UNREACHABLE
+        with np.errstate(all='ignore'):
+            return np.where(reached, d, 0).sum(axis=1) / reached.sum(axis=1)
+
+    # proximity of a set of drug targets (gene names)
+    # returns (n_targets, distance, random mean, random std, z-score); the targets
+    # that are not in the network are ignored
+    def proximity(self, targets):
+        target_ids = self.graph.indexes(targets)
+        target_ids = np.unique(target_ids[target_ids >= 0])
+        if len(target_ids) == 0:
+            return 0, np.nan, np.nan, np.nan, np.nan
+
+        distance = self._closest(self.rows[:1], target_ids[None, :])[0]
+
+        # random target sets are seeded by the targets, so a drug always gets the same ones
+        rng = np.random.default_rng([self.seed] + target_ids.tolist())
+        random_targets = random_gene_sets(target_ids, self.bins, self.bin_members, self.n_random, rng)
+        # random target set i is scored against random gene set i
+        random_distances = self._closest(self.rows[1:], random_targets)
+
+        mean = np.nanmean(random_distances)
+        std = np.nanstd(random_distances)
+        z = (distance - mean) / std if std > 0 else np.nan
+        return len(target_ids), distance, mean, std, z
+
+    # proximity of every drug of {drug: target genes}
+    # drugs with the same targets are scored once; with n_workers > 1 the distinct
+    # target sets are scored across a process pool
+    def proximities(self, targets_by_drug):
+        keys = {drug: tuple(sorted(set(targets))) for drug, targets in targets_by_drug.items()}
+        target_sets = list(dict.fromkeys(keys.values()))
+
+        if self.n_workers > 1 and len(target_sets) > 1:
+            with Pool(self.n_workers, initializer=_init_proximity_worker, initargs=(self,)) as pool:
+                chunksize = max(1, len(target_sets) // (4*self.n_workers))
+                scores = list(tqdm(pool.imap(_proximity, target_sets, chunksize=chunksize), total=len(target_sets)))
+        else:
+            scores = [self.proximity(key) for key in tqdm(target_sets)]
+        scores = dict(zip(target_sets, scores))
+
+        rows = [(drug,) + scores[key] for drug, key in keys.items()]
+
+        return pd.DataFrame(rows, columns=['drug','n_targets','distance','random_mean','random_std','z_score'])
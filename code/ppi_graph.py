@@ -0,0 +1,139 @@
+"""
+#!/usr/bin/env python
+# Description:
+## This script holds a compact, array backed representation of the PPI network
+## genes are numbered 0..n-1 (in sorted order) and the adjacency is stored in CSR
+## form: the neighbors of gene i are indices[indptr[i]:indptr[i+1]], sorted
+## the graph is undirected, without self-loops or duplicate edges -- the same
+## graph as nx.from_pandas_edgelist followed by removing the self-loops
+## it is saved as .npy files that can be memory mapped, and converted to NetworkX
+## for code that still needs it
+## Usage: from ppi_graph import CSRGraph
+##        ppi = CSRGraph.from_csv("../data/raw/PPI_net.csv")
+"""
+
+# import packages
+import os
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+class CSRGraph:
+
+    def __init__(self, genes, indptr, indices):
+        self.genes = genes
+        self.indptr = indptr
+        self.indices = indices
+        self._gene_index = None
+
+    # graph of the edges between two sequences of gene names
+    # self-loops are removed but their genes are kept as nodes
+    @classmethod
+    def from_edges(cls, genes_a, genes_b):
+        genes_a = pd.Series(genes_a).reset_index(drop=True)
+        genes_b = pd.Series(genes_b).reset_index(drop=True)
+        # edges with a missing gene are dropped
+        known = (genes_a.notna() & genes_b.notna()).to_numpy()
+        genes_a = genes_a[known]
+        genes_b = genes_b[known]
+
+        codes, genes = pd.factorize(pd.concat([genes_a, genes_b]), sort=True)
+        n_genes = len(genes)
+        src = codes[:len(genes_a)].astype(np.int64)
+        dst = codes[len(genes_a):].astype(np.int64)
+
+        # both directions of every edge, self-loops removed
+        loop = src == dst
+        src, dst = np.concatenate([src[~loop], dst[~loop]]), np.concatenate([dst[~loop], src[~loop]])
+
+        # unique edges, sorted by gene then neighbor
+        keys = np.unique(src * n_genes + dst)
+        src = keys // n_genes
+
+        indptr = np.zeros(n_genes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_genes), out=indptr[1:])
+        indices = (keys % n_genes).astype(np.int32)
+
+        return cls(np.asarray(genes, dtype=str), indptr, indices)
+
+    @classmethod
+    def from_csv(cls, path="../data/raw/PPI_net.csv"):
+        ppi_data = pd.read_csv(path, usecols=['Symbol_A','Symbol_B'])
+        return cls.from_edges(ppi_data.Symbol_A, ppi_data.Symbol_B)
+
+    @classmethod
+    def from_networkx(cls, g):
+        genes_a, genes_b = zip(*g.edges()) if g.number_of_edges() else ((), ())
+        # every node is added as a self-loop so isolated nodes are kept
+        return cls.from_edges(list(genes_a) + list(g.nodes()), list(genes_b) + list(g.nodes()))
+
+    # the arrays are saved as .npy files in a directory
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ['genes', 'indptr', 'indices']:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    # mmap_mode='r' maps the arrays instead of reading them into memory
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ['genes', 'indptr', 'indices']]
+        return cls(*arrays)
+
+    ### graph properties
+
+    def __len__(self):
+        return len(self.genes)
+
+    def number_of_nodes(self):
+        return len(self.genes)
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def _gene_ids(self):
+        if self._gene_index is None:
+            self._gene_index = {g: i for i, g in enumerate(self.genes.tolist())}
+        return self._gene_index
+
+    # index of a gene name
+    def index(self, gene):
+        return self._gene_ids()[gene]
+
+    # indexes of the given genes, -1 for the genes that are not in the network
+    def indexes(self, genes):
+        gene_ids = self._gene_ids()
+        return np.array([gene_ids.get(g, -1) for g in genes], dtype=np.int64)
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def has_edge(self, i, j):
+        row = self.neighbors(i)
+        k = np.searchsorted(row, j)
+        return k < len(row) and row[k] == j
+
+    # (gene index, gene index) of every edge, each edge once
+    def edges(self):
+        src = np.repeat(np.arange(len(self.genes)), self.degree())
+        upper = src < self.indices
+        return src[upper], self.indices[upper]
+
+    ### conversions
+
+    def to_networkx(self):
+        g = nx.Graph()
+        genes = self.genes.tolist()
+        g.add_nodes_from(genes)
+        src, dst = self.edges()
+        g.add_edges_from(zip([genes[i] for i in src], [genes[j] for j in dst]))
+        return g
+
+    # adjacency as a scipy.sparse csr matrix (sharing the arrays)
+    def to_scipy(self):
+        from scipy.sparse import csr_matrix
+        data = np.ones(len(self.indices), dtype=np.int8)
+        return csr_matrix((data, self.indices, self.indptr), shape=(len(self.genes), len(self.genes)))
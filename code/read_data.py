@@ -5,8 +5,13 @@ Date = 03/15/2022
 
 # Description:
 ## This script reads all the curated clinical trials data
-## run the load_data() method to create global variables
-## Usage: import using from read_data import *
+## the tables are attributes of a CTDataset, loaded the first time they are used
+## and reloaded when one of their files changes
+## Usage: from read_data import CTDataset
+##        data = CTDataset()
+##        data.dt_trial_df
+## or run the load_data() method to create global variables (import using from read_data import *)
+## the pipeline tables are read from parquet with CT_STORAGE_FORMAT=parquet (see ct_storage.py)
 """
 
 ### List of data files needed:
@@ -19,102 +24,454 @@ Date = 03/15/2022
 # ../data/raw/drug_approved_mapping.csv
 
 # import packages
+import os
+import sys
+import json
+import calendar
 import pandas as pd
 import numpy as np
 from tqdm import tqdm_notebook
 import networkx as nx
 import time
+from ct_storage import read_table, table_path
+from ct_dates import add_start_dates
+from ppi_graph import CSRGraph
+from ct_index import CTIndex
+
+DATA_FILES = {'trials': "../data/raw/organized_ct_data.csv",
+              'drug_mapped': "../data/out/drug_mapped_ct_data.csv",
+              'drugbank': "../data/raw/all_drugbank_drugs.csv",
+              'ppi': "../data/raw/PPI_net.csv",
+              'placebo': "../data/out/placebo_trials.csv",
+              'druggable_genome': "../data/raw/druggable_genome.tsv",
+              'drug_approval': "../data/raw/drug_approved_mapping.csv"}
+
+# tables written by the pipeline, stored as csv or parquet (see ct_storage.py)
+PIPELINE_TABLES = ['trials', 'drug_mapped', 'placebo']
+
+# derived tables saved to the snapshot, with the files they are built from
+SNAPSHOT_DIR = "../data/out/snapshot"
+# bumped whenever the derived tables change, so older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+SNAPSHOT_TABLES = {'dt_trial_df': ['drug_mapped', 'trials', 'drugbank', 'placebo'],
+                   'dt_start_year': ['drug_mapped', 'trials', 'drugbank', 'placebo']}
+
+# the ppi network as CSR arrays (see ppi_graph.py), memory mapped from here while
+# it is newer than PPI_net.csv
+PPI_CSR_DIR = "../data/out/ppi_csr"
+
+# compact mode: string columns are dictionary encoded as categoricals
+# the key columns share one vocabulary across the tables (e.g. intervention, Name
+# and drug_map are all coded against the drug names), so merges join on the codes
+SHARED_VOCABULARIES = {'nct_id': 'trials', 'intervention': 'drugs', 'Name': 'drugs', 'drug_map': 'drugs',
+                       'Gene_Target': 'genes'}
+# other string columns are encoded (against a vocabulary named after the column)
+# when at most this fraction of their values are distinct
+MAX_DISTINCT_RATIO = 0.5
+
+# memory of a column as python strings, also for a categorical column
+# (the same estimate as memory_usage(deep=True) for an object column)
+def object_memory(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        sizes = np.array([sys.getsizeof(c) for c in column.cat.categories] + [sys.getsizeof(np.nan)])
+        return int(sizes[column.cat.codes.to_numpy()].sum()) + 8*len(column)
+    return int(column.memory_usage(deep=True, index=False))
+
+# memory of a table, without the categories of its categorical columns: these
+# are shared vocabularies (see CTDataset.memory_report), so only the codes count
+def table_memory(table):
+    memory = 0
+    for c in table.columns:
+        if isinstance(table[c].dtype, pd.CategoricalDtype):
+            memory += table[c].cat.codes.nbytes
+        else:
+            memory += int(table[c].memory_usage(deep=True, index=False))
+    return memory
+
+# the clinical trials data
+# every table is loaded on first access and kept in memory; it is loaded again
+# when one of the files it is built from changes (size or modification time)
+class CTDataset:
+
+    def __init__(self, files=DATA_FILES, verbose=True, snapshot_dir=SNAPSHOT_DIR, compact=False):
+        self.files = dict(files)
+        self.verbose = verbose
+        # derived tables are read from the snapshot when it is newer than their files
+        # (None to always build them)
+        self.snapshot_dir = snapshot_dir
+        # table name -> (file stamps, table)
+        self._tables = {}
+
+        # string columns are stored as categoricals with shared vocabularies
+        self.compact = compact
+        # vocabulary name -> categories; values are only ever appended, so the codes
+        # of the tables already encoded stay valid
+        self._vocabularies = {}
+        # table name -> (memory before, memory after) of the encoding
+        self._memory = {}
+
+    def _print(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def _path(self, key):
+        if key in PIPELINE_TABLES:
+            return table_path(self.files[key])
+        return self.files[key]
+
+    def _stamps(self, keys):
+        stamps = []
+        for k in keys:
+            stat = os.stat(self._path(k))
+            stamps.append((k, stat.st_size, stat.st_mtime_ns))
+        return tuple(stamps)
+
+    # the memoized table, built again if one of its files changed
+    def _table(self, name, keys, build):
+        stamps = self._stamps(keys)
+        cached = self._tables.get(name)
+        if cached is not None and cached[0] == stamps:
+            return cached[1]
+
+        table = build()
+        if self.compact and isinstance(table, pd.DataFrame):
+            table = self._encode(name, table)
+        self._tables[name] = (stamps, table)
+        return table
+
+    # tables currently in memory
+    def loaded(self):
+        return list(self._tables)
+
+    # drop one (or all) memoized tables
+    def invalidate(self, name=None):
+        if name is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(name, None)
+
+    ### compact mode
+
+    def _vocabulary_name(self, table, column):
+        if column in SHARED_VOCABULARIES:
+            return SHARED_VOCABULARIES[column]
+        values = table[column]
+        if values.dtype == object and values.nunique() > MAX_DISTINCT_RATIO*len(values):
+            return None
+        return column
+
+    # the categories of a vocabulary, extended with the new values
+    def _vocabulary(self, name, values):
+        vocabulary = self._vocabularies.get(name, pd.Index([], dtype=object))
+        new_values = pd.Index(values.dropna().unique()).difference(vocabulary)
+        if len(new_values):
+            vocabulary = vocabulary.append(new_values)
+            self._vocabularies[name] = vocabulary
+        return vocabulary
+
+    # dictionary encode the string columns of a table, and report its memory
+    def _encode(self, name, table):
+        table = table.copy(deep=False)
+        before = 0
+        for c in table.columns:
+            if table[c].dtype != object and not isinstance(table[c].dtype, pd.CategoricalDtype):
+                before += int(table[c].memory_usage(deep=True, index=False))
+                continue
+            before += object_memory(table[c])
+            vocabulary_name = self._vocabulary_name(table, c)
+            if vocabulary_name is not None:
+                table[c] = pd.Categorical(table[c], categories=self._vocabulary(vocabulary_name, table[c]))
+
+        after = table_memory(table)
+        self._memory[name] = (before, after)
+        self._print("%s: %.1f MB -> %.1f MB" % (name, before/1e6, after/1e6))
+        return table
+
+    # the categorical columns of a table recoded against the current vocabularies
+    # (a vocabulary may have grown since the table was encoded)
+    def _align(self, table):
+        table = table.copy(deep=False)
+        for c in table.columns:
+            vocabulary_name = SHARED_VOCABULARIES.get(c, c)
+            if isinstance(table[c].dtype, pd.CategoricalDtype) and vocabulary_name in self._vocabularies:
+                vocabulary = self._vocabularies[vocabulary_name]
+                if len(table[c].cat.categories) != len(vocabulary):
+                    table[c] = table[c].cat.set_categories(vocabulary)
+        return table
+
+    # pd.merge, joining on the codes of the shared vocabularies in compact mode
+    def _merge(self, left, right, **kwargs):
+        if self.compact:
+            left = self._align(left)
+            right = self._align(right)
+        return pd.merge(left, right, **kwargs)
+
+    # memory (MB) of the loaded tables before and after the encoding (the codes of
+    # their categorical columns), then one 'vocabulary:<name>' row per vocabulary --
+    # each vocabulary is counted once, however many tables share it
+    def memory_report(self):
+        rows = [(name, before/1e6, after/1e6) for name, (before, after) in self._memory.items()]
+        rows += [('vocabulary:' + name, np.nan, vocabulary.memory_usage(deep=True)/1e6)
+                 for name, vocabulary in self._vocabularies.items()]
+        report = pd.DataFrame(rows, columns=['table','before_mb','after_mb'])
+        report['ratio'] = report.after_mb / report.before_mb
+        return report
+
+    ### snapshot of the derived tables
+
+    def _manifest_path(self):
+        return os.path.join(self.snapshot_dir, 'manifest.json')
+
+    # True if the snapshot was built (by this version) after its files last changed
+    def snapshot_valid(self):
+        if self.snapshot_dir is None or not os.path.exists(self._manifest_path()):
+            return False
+        with open(self._manifest_path()) as f:
+            manifest = json.load(f)
+        if manifest['version'] != SNAPSHOT_VERSION or manifest['files'] != self.files:
+            return False
+
+        keys = {k for name in SNAPSHOT_TABLES for k in SNAPSHOT_TABLES[name]}
+        return all(os.stat(self._path(k)).st_mtime_ns <= manifest['built_ns'] for k in keys)
+
+    # the derived table from the snapshot if it is valid, else built from its files
+    def _snapshot_table(self, name, build):
+        if self.snapshot_valid():
+            self._print("loading %s from the snapshot" % name)
+            return pd.read_parquet(os.path.join(self.snapshot_dir, name + '.parquet'))
+        return build()
+
+    # build the derived tables from their files and save them to the snapshot
+    # (parquet files, plus a manifest written last)
+    def build_snapshot(self):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        if os.path.exists(self._manifest_path()):
+            os.remove(self._manifest_path())
+
+        # files changed while the snapshot is built make it stale
+        built_ns = time.time_ns()
+        for name, build in [('dt_trial_df', self._load_dt_trial), ('dt_start_year', self._load_start_year)]:
+            build().to_parquet(os.path.join(self.snapshot_dir, name + '.parquet'), index=False)
+
+        with open(self._manifest_path(), 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'files': self.files, 'built_ns': built_ns,
+                       'tables': list(SNAPSHOT_TABLES)}, f)
+        self._print("snapshot saved to", self.snapshot_dir)
+
+    ### tables
+
+    @property
+    def df(self):
+        return self._table('df', ['trials'], self._load_trials)
+
+    def _load_trials(self):
+        # typed start date columns, parsed here if the trials were extracted without them
+        df = add_start_dates(read_table(self.files['trials']))
+        self._print("Number of Trials:", df.nct_id.nunique())
+        self._print("--")
+        return df
+
+    @property
+    def drug_df(self):
+        return self._table('drug_df', ['drug_mapped'], self._load_drug_mapped)
+
+    def _load_drug_mapped(self):
+        drug_df = read_table(self.files['drug_mapped'])
+        # the curation writes the drugbank name as Name
+        drug_df = drug_df.rename(columns={'Name':'intervention'})
+        self._print("Number of Drug Trials:", drug_df.nct_id.nunique())
+        # only reported when the trials are already loaded, so drug_df does not load them
+        if self.verbose and 'df' in self._tables:
+            df = self._tables['df'][1]
+            self._print("Proportion of drug trials mapped:", float(drug_df.nct_id.nunique())/float(df[~(df.intervention_types.isna()) & (df.intervention_types.str.contains('Drug'))].nct_id.nunique()))
+        self._print("Number of Interventions:", drug_df.intervention.nunique())
+        self._print("--")
+        return drug_df
+
+    @property
+    def db_target_df(self):
+        return self._table('db_target_df', ['drugbank'], self._load_drugbank)
+
+    def _load_drugbank(self):
+        db_target_df = pd.read_csv(self.files['drugbank'])
+        db_target_df['Name'] = db_target_df.Name.str.lower()
+        db_target_df = db_target_df[db_target_df.organism == "Humans"]
+        self._print("drugbank...")
+        self._print("Number of drugs:", db_target_df.Name.nunique())
+        self._print("Number of targets:", db_target_df.Gene_Target.nunique())
+        self._print("--")
+        return db_target_df
+
+    # drugs of the trials with their targets, before the placebos are added
+    @property
+    def _trial_targets(self):
+        return self._table('_trial_targets', ['drug_mapped', 'trials', 'drugbank'], self._load_trial_targets)
+
+    def _load_trial_targets(self):
+        dt_trial_df = self._merge(self.drug_df, self.db_target_df[['Name','Gene_Target','gene_type','known_action']], how='left',left_on='intervention',right_on='Name')
+        self._print("clinical trials...")
+        self._print("Number of Targets:", dt_trial_df.Gene_Target.nunique())
+        dt_trial_df = self._merge(dt_trial_df, self.df[['nct_id','start_date','start_month','start_year','start_datetime','phase','conditions']], how='inner')
+        return dt_trial_df
+
+    @property
+    def dt_trial_df(self):
+        return self._table('dt_trial_df', SNAPSHOT_TABLES['dt_trial_df'],
+                           lambda: self._snapshot_table('dt_trial_df', self._load_dt_trial))
+
+    def _load_dt_trial(self):
+        placebo_trials = self.placebo_trials
+        dt_trial_df = self._merge(self._trial_targets, placebo_trials[['nct_id','drug_map','placebo']], how='left', left_on=['nct_id','intervention'], right_on=['nct_id','drug_map'])
+        dt_trial_df['placebo'] = dt_trial_df.placebo.fillna(False)
+        return dt_trial_df
+
+    @property
+    def dt_start_year(self):
+        return self._table('dt_start_year', SNAPSHOT_TABLES['dt_start_year'],
+                           lambda: self._snapshot_table('dt_start_year', self._load_start_year))
+
+    def _load_start_year(self):
+        dt_start_year = self._trial_targets
+        dt_start_year = dt_start_year[~dt_start_year.start_year.isna()].copy()
+
+        # month name and year of the start date (e.g. July 1999, the day is dropped)
+        dt_start_year['month'] = dt_start_year.start_month.astype(int).map(dict(enumerate(calendar.month_name)))
+        dt_start_year['year'] = dt_start_year.start_year.astype(int)
+        dt_start_year['start_date'] = dt_start_year.month + ' ' + dt_start_year.year.astype(str)
+
+        placebo_trials = self.placebo_trials
+        dt_start_year = self._merge(dt_start_year, placebo_trials[['nct_id','drug_map','placebo']], how='left', left_on=['nct_id','intervention'], right_on=['nct_id','drug_map'])
+        dt_start_year['placebo'] = dt_start_year.placebo.fillna(False)
+        return dt_start_year
+
+    @property
+    def ppi_g(self):
+        return self._table('ppi_g', ['ppi'], self._load_ppi)
+
+    def _load_ppi(self):
+        self._print("loading ppi network")
+        ppi_data = pd.read_csv(self.files['ppi'])
+        ppi_data = ppi_data[['Symbol_A','Symbol_B']]
+        ppi_data.columns = ['protein_1','protein_2']
+        if self.verbose:
+            self._print("Number of genes:", len(set.union(set(ppi_data.protein_1), set(ppi_data.protein_2))))
+            self._print("Number of interactions:", ppi_data.drop_duplicates().shape[0])
+
+        ppi_g = nx.from_pandas_edgelist(ppi_data, "protein_1", "protein_2", create_using = nx.Graph())
+        ppi_g.remove_edges_from(nx.selfloop_edges(ppi_g))
+        self._print("Number of nodes:", ppi_g.number_of_nodes())
+        self._print("Number of edges:", ppi_g.number_of_edges())
+        self._print("--")
+        return ppi_g
+
+    # inverted indexes between trials, drugs, target genes and conditions (see ct_index.py)
+    @property
+    def ct_index(self):
+        return self._table('ct_index', ['drug_mapped', 'trials', 'drugbank'], lambda: CTIndex.from_dataset(self))
+
+    # the ppi network as a CSRGraph, the same graph as ppi_g without NetworkX
+    @property
+    def ppi_csr(self):
+        return self._table('ppi_csr', ['ppi'], self._load_ppi_csr)
+
+    def _load_ppi_csr(self):
+        saved = os.path.join(PPI_CSR_DIR, 'indices.npy')
+        if os.path.exists(saved) and os.stat(saved).st_mtime_ns >= os.stat(self._path('ppi')).st_mtime_ns:
+            ppi_csr = CSRGraph.load(PPI_CSR_DIR)
+        else:
+            ppi_csr = CSRGraph.from_csv(self.files['ppi'])
+            ppi_csr.save(PPI_CSR_DIR)
+        self._print("ppi network: %d genes, %d interactions" % (ppi_csr.number_of_nodes(), ppi_csr.number_of_edges()))
+        return ppi_csr
+
+    @property
+    def placebo_trials(self):
+        return self._table('placebo_trials', ['placebo'], self._load_placebo)
+
+    def _load_placebo(self):
+        placebo_trials = read_table(self.files['placebo'])
+        placebo_trials = placebo_trials.drop_duplicates()
+        placebo_trials['placebo'] = True
+        self._print("Number of placebo trials:", placebo_trials.nct_id.nunique())
+        self._print("Number of placebo drugs:", placebo_trials.drug_map.nunique())
+        self._print("--")
+        return placebo_trials
+
+    @property
+    def druggable_genome_df(self):
+        return self._table('druggable_genome_df', ['druggable_genome'], self._load_druggable_genome)
+
+    def _load_druggable_genome(self):
+        druggable_genome_df = pd.read_csv(self.files['druggable_genome'], sep='\t')
+        #druggable_genome_df = druggable_genome_df[druggable_genome_df.category == 'DRUGGABLE GENOME']
+        return druggable_genome_df
+
+    # druggable genes that are not in the ppi network
+    @property
+    def druggable_genome_set(self):
+        return self._table('druggable_genome_set', ['druggable_genome', 'ppi'], self._load_druggable_genome_set)
+
+    def _load_druggable_genome_set(self):
+        druggable_genome_set = set(self.druggable_genome_df.entrez_gene_symbol.tolist())
+        druggable_genome_set = druggable_genome_set - set(list(self.ppi_g.nodes()))
+        self._print("Num druggable genes:", len(druggable_genome_set))
+        self._print("--")
+        return druggable_genome_set
+
+    @property
+    def drug_approval_dates(self):
+        return self._table('drug_approval_dates', ['drug_approval', 'drug_mapped', 'trials', 'drugbank', 'placebo'],
+                           self._load_drug_approval)
+
+    def _load_drug_approval(self):
+        dt_trial_df = self.dt_trial_df
+        drug_approval_dates = pd.read_csv(self.files['drug_approval'])
+        self._print("N approved drugs:", drug_approval_dates.db_id.nunique())
+        drug_approval_dates['Name'] = drug_approval_dates.Name.str.lower()
+        drug_approval_dates.columns = ['db_id', 'product_name', 'intervention', 'labeler', 'start_marketting',
+           'end_marketting', 'fda_app_num', 'approved', 'country', 'source',
+           'Funder', 'approval_date', 'approval_year']
+        drug_approval_dates = drug_approval_dates[drug_approval_dates.intervention.isin(dt_trial_df.intervention)]
+        drug_approval_dates['approval_year'] = drug_approval_dates.approval_year.astype(int)
+
+        #only consider FDA drugs
+        drug_approval_dates = drug_approval_dates[drug_approval_dates.country == 'US']
+
+        self._print("Number of drugs in CT mapped with approval dates:", drug_approval_dates.intervention.nunique())
+        if self.verbose:
+            self._print("Number of targets in CT:", dt_trial_df[dt_trial_df.intervention.isin(drug_approval_dates.intervention)].Gene_Target.nunique())
+
+        self._print("--")
+        return drug_approval_dates
+
+# dataset shared by load_data()
+dataset = CTDataset()
 
 # file to load all the ct data
-def load_data():
+# compact=True stores the string columns as categoricals (see CTDataset)
+def load_data(compact=False):
+    global dataset
     global df, drug_df, db_target_df, dt_trial_df, dt_start_year
     global ppi_g
     global placebo_trials, druggable_genome_df
     global drug_approval_dates
 
-    df = pd.read_csv("../data/raw/organized_ct_data.csv")
-    print("Number of Trials:", df.nct_id.nunique())
-    print("--")
-
-    drug_df = pd.read_csv("../data/out/drug_mapped_ct_data.csv")
-    print("Number of Drug Trials:", drug_df.nct_id.nunique())
-    print("Proportion of drug trials mapped:", float(drug_df.nct_id.nunique())/float(df[~(df.intervention_types.isna()) & (df.intervention_types.str.contains('Drug'))].nct_id.nunique()))
-    print("Number of Interventions:", drug_df.intervention.nunique())
-    print("--")
-
-    db_target_df = pd.read_csv("../data/raw/all_drugbank_drugs.csv")
-    db_target_df['Name'] = db_target_df.Name.str.lower()
-    db_target_df = db_target_df[db_target_df.organism == "Humans"]
-    print("drugbank...")
-    print("Number of drugs:", db_target_df.Name.nunique())
-    print("Number of targets:", db_target_df.Gene_Target.nunique())
-    print("--")
-
-    dt_trial_df = pd.merge(drug_df, db_target_df[['Name','Gene_Target','gene_type','known_action']], how='left',left_on='intervention',right_on='Name')
-    print("clinical trials...")
-    print("Number of Targets:", dt_trial_df.Gene_Target.nunique())
-    dt_trial_df = pd.merge(dt_trial_df, df[['nct_id','start_date','phase','conditions']], how='inner')
-
-    dt_start_year = dt_trial_df
-    dt_start_year = dt_start_year[~dt_start_year.start_date.isna()]
-
-    # get the year
-    dt_start_year['start_date'] = [i.split(' ')[0]+' '+i.split(' ')[-1] if ',' in i else i for i in dt_start_year.start_date.tolist()]
-    dt_start_year['month'] = [i.split(' ')[0] for i in dt_start_year.start_date.tolist()]
-    dt_start_year['year'] = [i.split(' ')[-1] for i in dt_start_year.start_date.tolist()]
-    dt_start_year['year'] = dt_start_year.year.astype(int)
-
-    # add phase
-    dt_start_year = pd.merge(dt_start_year, df[['nct_id','phase']], how ='left')
-    dt_start_year['year'] = dt_start_year.year.astype(int)
-
-    print("loading ppi network")
-    ppi_data = pd.read_csv("../data/raw/PPI_net.csv")
-    ppi_data = ppi_data[['Symbol_A','Symbol_B']]
-    ppi_data.columns = ['protein_1','protein_2']
-    print("Number of genes:", len(set.union(set(ppi_data.protein_1), set(ppi_data.protein_2))))
-    print("Number of interactions:", ppi_data.drop_duplicates().shape[0])
-
-    ppi_g = nx.from_pandas_edgelist(ppi_data, "protein_1", "protein_2", create_using = nx.Graph())
-    ppi_g.remove_edges_from(nx.selfloop_edges(ppi_g))
-    print(nx.info(ppi_g))
-    print("--")
-
-    placebo_trials = pd.read_csv("../data/out/placebo_trials.csv")
-    placebo_trials = placebo_trials.drop_duplicates()
-    placebo_trials['placebo'] = True
-    print("Number of placebo trials:", placebo_trials.nct_id.nunique())
-    print("Number of placebo drugs:", placebo_trials.drug_map.nunique())
-    print("--")
-
-    dt_start_year = pd.merge(dt_start_year, placebo_trials[['nct_id','drug_map','placebo']], how='left', left_on=['nct_id','intervention'], right_on=['nct_id','drug_map'])
-    dt_start_year['placebo'] = dt_start_year.placebo.fillna(False)
-
-    dt_trial_df = pd.merge(dt_trial_df, placebo_trials[['nct_id','drug_map','placebo']], how='left', left_on=['nct_id','intervention'], right_on=['nct_id','drug_map'])
-    dt_trial_df['placebo'] = dt_trial_df.placebo.fillna(False)
-
-    druggable_genome_df = pd.read_csv("../data/raw/druggable_genome.tsv", sep='\t')
-    #druggable_genome_df = druggable_genome_df[druggable_genome_df.category == 'DRUGGABLE GENOME']
-    druggable_genome_set = set(druggable_genome_df.entrez_gene_symbol.tolist())
-    druggable_genome_set = druggable_genome_set - set(list(ppi_g.nodes()))
-    print("Num druggable genes:", len(druggable_genome_set))
-    print("--")
-
-    drug_approval_dates = pd.read_csv("../data/raw/drug_approved_mapping.csv")
-    print("N approved drugs:", drug_approval_dates.db_id.nunique())
-    drug_approval_dates['Name'] = drug_approval_dates.Name.str.lower()
-    drug_approval_dates.columns = ['db_id', 'product_name', 'intervention', 'labeler', 'start_marketting',
-       'end_marketting', 'fda_app_num', 'approved', 'country', 'source',
-       'Funder', 'approval_date', 'approval_year']
-    drug_approval_dates = drug_approval_dates[drug_approval_dates.intervention.isin(dt_trial_df.intervention)]
-    drug_approval_dates['approval_year'] = drug_approval_dates.approval_year.astype(int)
-
-    #only consider FDA drugs
-    drug_approval_dates = drug_approval_dates[drug_approval_dates.country == 'US']
-
-    print("Number of drugs in CT mapped with approval dates:", drug_approval_dates.intervention.nunique())
-    print("Number of targets in CT:", dt_trial_df[dt_trial_df.intervention.isin(drug_approval_dates.intervention)].Gene_Target.nunique())
-    
-    print("--")
+    if dataset.compact != compact:
+        dataset = CTDataset(compact=compact)
+
+    df = dataset.df
+    drug_df = dataset.drug_df
+    db_target_df = dataset.db_target_df
+    dt_trial_df = dataset.dt_trial_df
+    dt_start_year = dataset.dt_start_year
+    ppi_g = dataset.ppi_g
+    placebo_trials = dataset.placebo_trials
+    druggable_genome_df = dataset.druggable_genome_df
+    dataset.druggable_genome_set
+    drug_approval_dates = dataset.drug_approval_dates
 
     return df, drug_df, db_target_df, dt_trial_df, dt_start_year, ppi_g, placebo_trials, druggable_genome_df, drug_approval_dates
+
+# build the snapshot of the derived tables
+if __name__ == '__main__':
+    CTDataset().build_snapshot()